@@ -36,6 +36,8 @@ resource "aws_lambda_function" "channeler" {
       SECRET_NAME           = var.secret_name
       REFRESH_THRESHOLD_MIN = var.refresh_treshold_min
       STATE_MACHINE_ARN     = local.state_machine_arn
+      LEASE_TABLE_NAME      = aws_dynamodb_table.leases.name
+      LEASE_DURATION_SEC    = var.lambda_settings.channel_renewer.timeout
     }
   }
 }
@@ -47,6 +49,23 @@ resource "aws_lambda_alias" "channeler" {
   name             = "production"
 }
 
+# Leases used to ensure only one renewal proceeds at a time for each application
+resource "aws_dynamodb_table" "leases" {
+  name         = "${local.channel_function_name}-leases"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "application"
+
+  attribute {
+    name = "application"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
 data "archive_file" "channeler" {
   type        = "zip"
   source_dir  = "${path.module}/functions/channel_renewer"
@@ -70,6 +89,14 @@ data "aws_iam_policy_document" "channeler" {
     ]
     resources = ["arn:aws:states:${local.region}:${local.account_id}:execution:${local.channel_function_name}:*"]
   }
+  statement {
+    effect = "Allow"
+    actions = [
+      "dynamodb:PutItem",
+      "dynamodb:DeleteItem",
+    ]
+    resources = [aws_dynamodb_table.leases.arn]
+  }
   statement {
     effect    = "Allow"
     actions   = ["secretsmanager:GetSecretValue"]
@@ -40,8 +40,14 @@ resource "aws_lambda_function" "endpoint" {
       CHANNEL_TOKEN                = random_password.token.result
       SNS_TOPIC_ARN                = aws_sns_topic.logs.arn
       POWERTOOLS_METRICS_NAMESPACE = local.metrics_namespace
+      DEBUG_SAMPLE_RATE            = var.lambda_settings.endpoint.debug_sample_rate
+      OVERLAP_WINDOW_SEC           = var.lambda_settings.endpoint.overlap_window_sec
     }
   }
+
+  logging_config {
+    log_format = var.lambda_settings.endpoint.log_format
+  }
 }
 
 resource "aws_lambda_alias" "endpoint" {
@@ -55,6 +61,7 @@ data "archive_file" "endpoint" {
   type        = "zip"
   source_dir  = "${path.module}/functions/endpoint"
   output_path = "${path.module}/builds/endpoint.zip"
+  excludes    = ["server.py"] # standalone server is not used by the Lambda function
 }
 
 resource "aws_lambda_permission" "public_access" {
@@ -3,12 +3,16 @@ Lambda function to renew Google Admin (reports) SDK Push Notification channels
 using the "watch" api
 Reference: https://developers.google.com/admin-sdk/reports/v1/guides/push
 """
+import abc
 from datetime import datetime, timedelta, timezone
+import functools
 import json
 import logging
 import os
+import time
 
 import boto3
+from botocore.config import Config
 from googleapiclient import channel, discovery, errors
 from google.oauth2 import service_account
 from google.auth.exceptions import GoogleAuthError
@@ -20,9 +24,179 @@ LOGGER.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 EXPECTED_CHANNEL_TOKEN = os.environ['CHANNEL_TOKEN']
 
 
+class LeaseHeldError(Exception):
+    """Raised when a step function renewal cannot acquire the lease for its application
+
+    The step function retries the renewal with backoff on this error, and the execution
+    fails (triggering a recovery) if the lease is still held after all retries.
+    """
+
+
+class Lease(abc.ABC):
+    """Base class for a per-application lease, ensuring only one renewal proceeds at a time
+
+    Stale leases, such as those held by a function that timed out, may be
+    acquired by another owner once they have expired.
+    """
+    def __init__(self, duration: int):
+        self._duration = duration
+
+    def _expiration(self) -> int:
+        return int(datetime.now(tz=timezone.utc).timestamp()) + self._duration
+
+    @abc.abstractmethod
+    def acquire(self, key: str, owner: str) -> bool:
+        """Attempt to acquire the lease for this key
+
+        Args:
+            key (str): The key to lease (eg: application name)
+            owner (str): Unique identifier for this lease holder (eg: request ID)
+
+        Returns:
+            bool: True if the lease was acquired, or is already held by this owner
+        """
+
+    @abc.abstractmethod
+    def release(self, key: str, owner: str):
+        """Release the lease for this key, if held by this owner
+
+        Args:
+            key (str): The key to release
+            owner (str): Unique identifier for this lease holder
+        """
+
+
+class DynamoDBLease(Lease):
+    """Lease backed by conditional writes to a DynamoDB table"""
+    def __init__(self, table_name: str, duration: int):
+        super().__init__(duration)
+        self._table_name = table_name
+        self._client = _client('dynamodb')
+
+    def acquire(self, key: str, owner: str) -> bool:
+        now = int(datetime.now(tz=timezone.utc).timestamp())
+        try:
+            self._client.put_item(
+                TableName=self._table_name,
+                Item={
+                    'application': {'S': key},
+                    'owner': {'S': owner},
+                    'expires_at': {'N': str(self._expiration())},
+                },
+                ConditionExpression=(
+                    'attribute_not_exists(application) OR expires_at < :now OR #owner = :owner'
+                ),
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={
+                    ':now': {'N': str(now)},
+                    ':owner': {'S': owner},
+                },
+            )
+        except self._client.exceptions.ConditionalCheckFailedException:
+            return False
+
+        return True
+
+    def release(self, key: str, owner: str):
+        try:
+            self._client.delete_item(
+                TableName=self._table_name,
+                Key={'application': {'S': key}},
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={':owner': {'S': owner}},
+            )
+        except self._client.exceptions.ConditionalCheckFailedException:
+            LOGGER.warning('Lease for %s is no longer held by %s', key, owner)
+
+
+class LocalLease(Lease):
+    """In-memory lease, only suitable for testing or local development"""
+    def __init__(self, duration: int):
+        super().__init__(duration)
+        self._leases = {}
+
+    def acquire(self, key: str, owner: str) -> bool:
+        now = int(datetime.now(tz=timezone.utc).timestamp())
+        current_owner, expires_at = self._leases.get(key, (None, 0))
+        if current_owner not in {None, owner} and expires_at >= now:
+            return False
+
+        self._leases[key] = (owner, self._expiration())
+        return True
+
+    def release(self, key: str, owner: str):
+        if self._leases.get(key, (None, 0))[0] == owner:
+            del self._leases[key]
+
+
+# Interval at which a stop request polls for a lease held by an in-progress renewal, and
+# the time reserved to stop the application once the lease is acquired
+LEASE_POLL_SEC = 2
+STOP_RESERVED_MS = 10000
+
+
+def _wait_for_lease(lease: Lease, application: str, context) -> bool:
+    """Wait for the lease for this application to be released, while time remains
+
+    Args:
+        lease (Lease): The lease to acquire
+        application (str): The application name to acquire the lease for
+        context: The Lambda context object
+
+    Returns:
+        bool: True if the lease was acquired
+    """
+    while context.get_remaining_time_in_millis() > STOP_RESERVED_MS + LEASE_POLL_SEC * 1000:
+        time.sleep(LEASE_POLL_SEC)
+        if lease.acquire(application, context.aws_request_id):
+            return True
+
+    return False
+
+
+@functools.cache
+def _get_lease() -> Lease:
+    duration = int(os.environ.get('LEASE_DURATION_SEC', 300))
+    if 'LEASE_TABLE_NAME' not in os.environ:
+        LOGGER.warning('LEASE_TABLE_NAME is not set; falling back on in-memory lease')
+        return LocalLease(duration)
+
+    return DynamoDBLease(os.environ['LEASE_TABLE_NAME'], duration)
+
+
+CLIENT_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=5,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+)
+
+
+def _record_retries(parsed: dict, model, **_):
+    """Record the number of retries needed for any AWS API call that succeeded
+
+    The powertools layer is not used by this function, so retries are logged
+    """
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        LOGGER.warning('Request to %s succeeded after %d retries', model.name, retries)
+
+
+@functools.cache
+def _client(service: str):
+    """Return a client for this service, cached so connections are reused across invocations
+
+    Args:
+        service (str): The name of the AWS service
+    """
+    client = boto3.client(service, config=CLIENT_CONFIG)
+    client.meta.events.register('after-call', _record_retries)
+    return client
+
+
 def _get_secrets(secret_name: str):
-    client = boto3.client('secretsmanager')
-    secret = client.get_secret_value(SecretId=secret_name)
+    secret = _client('secretsmanager').get_secret_value(SecretId=secret_name)
     return json.loads(secret['SecretString'])
 
 
@@ -135,11 +309,16 @@ def _init_step_function(channel_info: dict):
     """
     LOGGER.info('Starting step function: %s', channel_info)
 
-    response = boto3.client('stepfunctions').start_execution(
-        stateMachineArn=os.environ['STATE_MACHINE_ARN'],
-        input=json.dumps(channel_info),
-        name=f'{channel_info["application"]}_{channel_info["channel_id"]}',
-    )
+    client = _client('stepfunctions')
+    try:
+        response = client.start_execution(
+            stateMachineArn=os.environ['STATE_MACHINE_ARN'],
+            input=json.dumps(channel_info),
+            name=f'{channel_info["application"]}_{channel_info["channel_id"]}',
+        )
+    except client.exceptions.ExecutionAlreadyExists:
+        LOGGER.warning('Step function already started for channel: %s', channel_info)
+        return
 
     LOGGER.info('Started step function: %s', response)
 
@@ -156,16 +335,21 @@ def _stop_step_function(channeler: Channeler, application: str) -> tuple[str, st
     """
     LOGGER.info('Stopping step function for application: %s', application)
 
-    snf_client = boto3.client('stepfunctions')
+    snf_client = _client('stepfunctions')
 
     response_iterator = snf_client.get_paginator('list_executions').paginate(
         stateMachineArn=os.environ['STATE_MACHINE_ARN'],
         statusFilter='RUNNING',
     )
 
-    # Filter to only executions that are for this application
-    filtered_iterator = response_iterator.search(
-        f'executions[?starts_with(name, `{application}`)].executionArn'
+    # Filter to only executions that are for this application. Execution names are formatted
+    # as <application>_<channel_id>, and some application names share a prefix with others
+    # (eg: groups and groups_enterprise), so the application must match exactly
+    filtered_iterator = (
+        execution['executionArn']
+        for page in response_iterator
+        for execution in page['executions']
+        if execution['name'].rsplit('_', 1)[0] == application
     )
 
     # There should only be one active execution per app, but iterate just in case (?)
@@ -198,7 +382,44 @@ def _stop_step_function(channeler: Channeler, application: str) -> tuple[str, st
             LOGGER.error('Channel could not be stopped: %s', err)
 
 
-def handler(event: dict, _) -> dict:
+def _renew(client: Channeler, event: dict, action: str) -> dict:
+    """Create a new channel for the application in this event and stop any old channel
+
+    Args:
+        client (Channeler): The channeler object used to create and stop channels
+        event (dict): The channel information for the application being renewed
+        action (str): The lambda action from the original event, if any
+    """
+    # The watchdog function triggers a recover event without the old input, since
+    # the existing execution is still running and must be stopped after renewal
+    restart = action == 'recover' and 'resource_id' not in event
+
+    # Create a new channel. This should occur before any old channels are stopped
+    channel_info = client.create_channel(
+        event['application'],
+        os.environ['LAMBDA_URL'],
+        os.environ['CHANNEL_TOKEN']
+    )
+
+    if restart:
+        # Stop the running execution, and its channel, before starting a new one
+        _stop_step_function(client, event['application'])
+
+    if action in {'init', 'recover'}:
+        # This is the first channel opened, or the pipeline is recovering
+        # from a failure, so start the step function execution
+        _init_step_function(channel_info)
+
+    if action == 'init' or restart:
+        return channel_info  # no old channels to handle, so return
+
+    # Stop the old channel only after a new one is created above
+    client.stop_channel(event['resource_id'], event['channel_id'])
+
+    return channel_info  # passed on to next step function invocation
+
+
+def handler(event: dict, context) -> dict:
     """
     This lambda is typically invoked after a "wait" state in a step function
 
@@ -207,6 +428,15 @@ def handler(event: dict, _) -> dict:
     of "resource_id" and "channel_id" values indicates an old channel that should
     be stopped after a new one is created.
 
+    A "recover" action without an "input" value is sent by the watchdog function
+    when a channel has silently stopped delivering notifications.
+
+    Renewals for an application are guarded by a lease, so concurrent invocations
+    for the same application (eg: step function renewal and recovery) do not open
+    duplicate channels. Step function renewals that cannot acquire the lease raise
+    a LeaseHeldError so they are retried, stop requests wait for the lease (or raise
+    a LeaseHeldError if it is not released in time), and other invocations are skipped.
+
     Example event:
         {
             "application": "<app-name>",
@@ -217,37 +447,40 @@ def handler(event: dict, _) -> dict:
     """
     LOGGER.info('Received event: %s', event)
 
-    keydata = _get_secrets(os.environ['SECRET_NAME'])
-    LOGGER.debug('Loaded secret data with keys: %s', list(keydata.keys()))
-
-    client = Channeler(keydata, os.environ['DELEGATION_EMAIL'])
-
     action = event.get('lambda_action')
-    if action == 'stop':
-        _stop_step_function(client, event['application'])
-        return None
 
     # EventBridge rule triggering a recover event
     # Swap out the event for the old input and try to restart this execution
-    if action == 'recover':
+    if action == 'recover' and 'input' in event:
         event = json.loads(event['input'])
 
-    # Create a new channel. This should occur before any old channels are stopped
-    channel_info = client.create_channel(
-        event['application'],
-        os.environ['LAMBDA_URL'],
-        os.environ['CHANNEL_TOKEN']
-    )
-
-    if action in {'init', 'recover'}:
-        # This is the first channel opened, or the pipeline is recovering
-        # from a failure, so start the step function execution
-        _init_step_function(channel_info)
-
-    if action == 'init':
-        return channel_info  # no old channels to handle, so return
-
-    # Stop the old channel only after a new one is created above
-    client.stop_channel(event['resource_id'], event['channel_id'])
-
-    return channel_info  # passed on to next step function invocation
+    lease = _get_lease()
+    if not lease.acquire(event['application'], context.aws_request_id):
+        if action is None:
+            # Skipping a step function renewal would end the renewal chain if the
+            # lease holder then fails, so raise to have the step function retry it
+            raise LeaseHeldError(f'Renewal already in progress for {event["application"]}')
+
+        if action == 'stop':
+            # Stopping during a renewal would leave the channel created by that renewal
+            # running, so wait for the renewal to finish and release the lease
+            LOGGER.info('Waiting for renewal in progress for %s', event['application'])
+            if not _wait_for_lease(lease, event['application'], context):
+                raise LeaseHeldError(f'Renewal still in progress for {event["application"]}')
+        else:
+            LOGGER.warning('Renewal already in progress for %s; skipping', event['application'])
+            return {'application': event['application'], 'skipped': True}
+
+    try:
+        keydata = _get_secrets(os.environ['SECRET_NAME'])
+        LOGGER.debug('Loaded secret data with keys: %s', list(keydata.keys()))
+
+        client = Channeler(keydata, os.environ['DELEGATION_EMAIL'])
+
+        if action == 'stop':
+            _stop_step_function(client, event['application'])
+            return None
+
+        return _renew(client, event, action)
+    finally:
+        lease.release(event['application'], context.aws_request_id)
@@ -2,19 +2,24 @@
 Lambda function to process incoming Push Notifications from Google
 Reference: https://developers.google.com/admin-sdk/reports/v1/guides/push
 """
+import collections
 from datetime import datetime, timezone
+import functools
 import json
 import logging
 import os
 import pathlib
 from urllib.parse import urlparse
+import zlib
 
 from aws_lambda_powertools import Metrics
 from aws_lambda_powertools.metrics import MetricUnit
 from aws_lambda_powertools.utilities.data_classes import event_source, LambdaFunctionUrlEvent
 import boto3
+from botocore.config import Config
 
 HEADER_CHANNEL_TOKEN = 'x-goog-channel-token'           # custom token, must match expected token
+HEADER_CHANNEL_ID = 'x-goog-channel-id'                 # ID of the channel delivering this message
 HEADER_CHANNEL_EXPIRATION = 'x-goog-channel-expiration' # "Wed, 27 Jul 2022 07:24:08 GMT"
 HEADER_RESOURCE_STATE = 'x-goog-resource-state'         # "sync", "download", etc
 HEADER_RESOURCE_URI = 'x-goog-resource-uri'             # path of resource (eg: applicationName)
@@ -31,7 +36,59 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 EXPECTED_CHANNEL_TOKEN = os.environ['CHANNEL_TOKEN']
-SNS_TOPIC = boto3.resource('sns').Topic(os.environ['SNS_TOPIC_ARN'])
+
+# Fraction of events (0.0 to 1.0) for which debug logging should be enabled
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_SAMPLE_RATE', 0))
+# Each execution environment handles one request at a time, so a single connection is sufficient
+CLIENT_CONFIG = Config(
+    connect_timeout=1,
+    read_timeout=3,
+    tcp_keepalive=True,
+    max_pool_connections=1,
+    retries={'mode': 'adaptive', 'max_attempts': 3},
+)
+
+
+# Calls may be made from worker threads and Metrics is not thread-safe, so retries are
+# collected here (deque appends and pops are atomic) and added as a metric by add_retry_metrics
+_RETRIES = collections.deque()
+
+
+def _record_retries(parsed: dict, **_):
+    """Record the number of retries needed for any AWS API call that succeeded"""
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        _RETRIES.append(retries)
+
+
+def add_retry_metrics():
+    """Add the retries recorded since the last call as a metric
+
+    Must be called from the thread that owns the metrics, not from a worker thread
+    """
+    retries = 0
+    while _RETRIES:
+        retries += _RETRIES.popleft()
+    if retries:
+        metrics.add_metric(name='ClientRetries', unit=MetricUnit.Count, value=retries)
+
+
+@functools.cache
+def sns_topic(arn: str, config: Config = CLIENT_CONFIG):
+    """Return the SNS topic resource, cached so connections are reused across invocations
+
+    Args:
+        arn (str): The ARN of the SNS topic
+        config (Config): The botocore config for the underlying client
+    """
+    topic = boto3.resource('sns', config=config).Topic(arn)
+    topic.meta.client.meta.events.register('after-call', _record_retries)
+    return topic
+
+
+# The standalone server (server.py) may publish to an alternate sink, in which case
+# the topic is not required
+SNS_TOPIC = sns_topic(os.environ['SNS_TOPIC_ARN']) if 'SNS_TOPIC_ARN' in os.environ else None
 
 
 def app_from_event(body: dict, headers: dict) -> str:
@@ -66,6 +123,48 @@ def app_from_event(body: dict, headers: dict) -> str:
     return app_name
 
 
+def event_key(body: dict) -> str | None:
+    """Return a key that uniquely identifies this event, if possible
+
+    This matches the key used for deduplication in the athena submodule, so the same
+    events are sampled for debug logging across both functions
+
+    Args:
+        body (dict): The event body
+    """
+    try:
+        return f"{body['id']['time']}:{body['id']['uniqueQualifier']}"
+    except (KeyError, TypeError):
+        return None
+
+
+def is_sampled(key: str | None) -> bool:
+    """Deterministically decide if debug logging should be enabled for this event
+
+    Args:
+        key (str): The unique key for this event
+    """
+    if not key or not DEBUG_SAMPLE_RATE:
+        return False
+
+    return zlib.crc32(key.encode()) % 10000 < DEBUG_SAMPLE_RATE * 10000
+
+
+def sampled_level(key: str | None) -> int | None:
+    """Return the level at which to log debug details for this event, if they should be logged
+
+    Details for sampled events are logged at INFO, so they are emitted at the default
+    log level without changing the level of the (shared) logger
+
+    Args:
+        key (str): The unique key for this event
+    """
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        return logging.DEBUG
+
+    return logging.INFO if is_sampled(key) else None
+
+
 def time_now() -> datetime:
     """Return the current time in UTC"""
     return datetime.now(tz=timezone.utc)
@@ -134,44 +233,183 @@ def send_to_sns(body: dict):
             metrics.add_metric(name='DroppedEvents', unit=MetricUnit.Count, value=1)
             return
         raise err # raise any other exception of this type
+    finally:
+        add_retry_metrics()
 
     LOGGER.debug('Published message to sns: %s', response)
 
 
-@metrics.log_metrics
-@event_source(data_class=LambdaFunctionUrlEvent) # pylint:disable=no-value-for-parameter
-def handler(event: LambdaFunctionUrlEvent, _):
-    """Lambda function handler for processing incoming Push Notifications
+class ChannelTracker:
+    """Track the active channel for each application to suppress duplicate events
 
-    Args:
-        event (LambdaFunctionUrlEvent): Incoming push notification from Google
+    Channels are renewed by creating a new channel before the old one is stopped, and
+    Google delivers the same events to both channels in the meantime. When an event
+    arrives on a channel that differs from the last one seen for this application, an
+    overlap window begins. Recently published events are remembered by their unique key
+    (and delivering channel) for the length of the window, and any that are received again
+    on a different channel during an overlap are duplicates. Redeliveries on the same
+    channel are never suppressed, since Google retries events that failed to publish.
+
+    This is best-effort, since state is only held in memory for this process.
     """
-    received_time = time_now()
+    def __init__(self, overlap_seconds: int):
+        self._overlap_seconds = overlap_seconds
+        self._channels = {}  # app name -> (channel ID, channel expiration)
+        self._overlap_until = {}  # app name -> timestamp
+        self._seen = {}  # app name -> {event key -> (channel ID, timestamp)}, in order of insertion
+
+    def _update_channel(self, app_name: str, channel_id: str, expiration: str | None,
+                        now: float):
+        active_id, active_exp = self._channels.get(app_name, (None, None))
+        if channel_id == active_id:
+            return
 
-    if event.get_header_value(HEADER_CHANNEL_TOKEN) != EXPECTED_CHANNEL_TOKEN:
-        raise RuntimeError('Invalid event:', event.raw_event)
+        exp = (
+            datetime.strptime(expiration, EXPIRATION_FORMAT).replace(tzinfo=timezone.utc)
+            if expiration else None
+        )
 
-    if event.get_header_value(HEADER_RESOURCE_STATE) == EVENT_TYPE_SYNC:
-        LOGGER.debug('Skipping sync event: %s', event.raw_event)
-        return  # not an error
+        if active_id:
+            LOGGER.info(
+                'Found overlapping channels for %s: %s, %s',
+                app_name,
+                active_id,
+                channel_id
+            )
+            self._overlap_until[app_name] = now + self._overlap_seconds
+
+        # The channel with the latest expiration is the most recently created one
+        if not active_id or (exp and (not active_exp or exp > active_exp)):
+            self._channels[app_name] = (channel_id, exp)
+
+    def _recent(self, app_name: str, now: float) -> dict:
+        # Remove keys that have aged out of the window; dicts retain insertion order
+        seen = self._seen.setdefault(app_name, {})
+        while seen and next(iter(seen.values()))[1] + self._overlap_seconds <= now:
+            del seen[next(iter(seen))]
+
+        return seen
+
+    def is_duplicate(self, app_name: str, channel_id: str | None, expiration: str | None,
+                     key: str | None, now: float) -> bool:
+        """Check if this event is a duplicate received during a channel renewal overlap
+
+        Args:
+            app_name (str): The application name for this event
+            channel_id (str): The ID of the channel delivering this event
+            expiration (str): The expiration time for this channel
+            key (str): The unique key for this event
+            now (float): The current timestamp, in seconds
+        """
+        if not channel_id or not key:
+            return False
+
+        self._update_channel(app_name, channel_id, expiration, now)
+
+        seen_channel_id, _ = self._recent(app_name, now).get(key, (channel_id, None))
+        if seen_channel_id == channel_id:
+            return False
+
+        return now < self._overlap_until.get(app_name, 0)
+
+    def record(self, app_name: str, channel_id: str | None, key: str | None, now: float):
+        """Remember an event once it has been published
+
+        Keys are remembered even before an overlap is detected, since the first
+        event on a new channel may have already been received on the old channel
+
+        Args:
+            app_name (str): The application name for this event
+            channel_id (str): The ID of the channel that delivered this event
+            key (str): The unique key for this event
+            now (float): The current timestamp, in seconds
+        """
+        if not channel_id or not key:
+            return
 
-    LOGGER.debug(
-        'Received valid message with headers: %s',
-        {header: value for header, value in event.headers.items() if header.startswith('x-goog-')}
+        self._recent(app_name, now).setdefault(key, (channel_id, now))
+
+
+CHANNEL_TRACKER = ChannelTracker(int(os.environ.get('OVERLAP_WINDOW_SEC', 60)))
+
+
+def record_published(headers: dict, body: dict, received_time: datetime):
+    """Record that this notification was published, so it can be recognized as a
+    duplicate if it is also delivered on an overlapping channel
+
+    Args:
+        headers (dict): The request headers, with lowercase names
+        body (dict): The published body, as returned by process_notification
+        received_time (datetime): The time this notification was received
+    """
+    CHANNEL_TRACKER.record(
+        body['id']['applicationName'],
+        headers.get(HEADER_CHANNEL_ID),
+        event_key(body),
+        received_time.timestamp()
     )
 
-    body = event.json_body
+
+def process_notification(headers: dict, raw_body: str | None, received_time: datetime) -> dict:
+    """Validate an incoming push notification and prepare its body for publishing
+
+    This is shared by the Lambda function handler and the standalone server (server.py)
+
+    Args:
+        headers (dict): The request headers, with lowercase names
+        raw_body (str): The request body
+        received_time (datetime): The time this notification was received
+
+    Returns:
+        dict: The body to publish, or None if this notification should be skipped
+            (eg: sync events, or duplicate events received during a channel renewal)
+    """
+    if headers.get(HEADER_CHANNEL_TOKEN) != EXPECTED_CHANNEL_TOKEN:
+        raise RuntimeError('Invalid event:', headers)
+
+    if headers.get(HEADER_RESOURCE_STATE) == EVENT_TYPE_SYNC:
+        LOGGER.debug('Skipping sync event for channel: %s', headers.get(HEADER_CHANNEL_ID))
+        return None  # not an error
+
+    body = json.loads(raw_body) if raw_body else None
     if not body:
-        raise RuntimeError('Empty body in event:', event.raw_event)
+        raise RuntimeError('Empty body in event:', headers)
+
+    key = event_key(body)
+    level = sampled_level(key)
+
+    # Avoid building the headers for logging unless they will be logged
+    if level:
+        LOGGER.log(
+            level,
+            'Received valid message with headers: %s',
+            {
+                header: value for header, value in headers.items()
+                if header.startswith('x-goog-') and header != HEADER_CHANNEL_TOKEN
+            },
+            extra={'event_key': key},
+        )
 
-    add_metrics(body, received_time, event.get_header_value(HEADER_CHANNEL_EXPIRATION))
+    add_metrics(body, received_time, headers.get(HEADER_CHANNEL_EXPIRATION))
 
-    app_name = app_from_event(body, event.headers)
+    app_name = app_from_event(body, headers)
 
     metrics.add_dimension(name='application', value=app_name)
 
-    expected_size = int(event.get_header_value(HEADER_CONTENT_LENGTH, 0))
-    raw_body_size = len(event.body)
+    if CHANNEL_TRACKER.is_duplicate(
+            app_name,
+            headers.get(HEADER_CHANNEL_ID),
+            headers.get(HEADER_CHANNEL_EXPIRATION),
+            key,
+            received_time.timestamp()):
+        if level:
+            LOGGER.log(level, 'Dropping duplicate event received during channel renewal: %s', key)
+        metrics.add_metric(name='SuppressedDuplicates', unit=MetricUnit.Count, value=1)
+        return None
+
+    # The content-length header is in bytes, rather than characters of the decoded body
+    expected_size = int(headers.get(HEADER_CONTENT_LENGTH, 0))
+    raw_body_size = len(raw_body.encode())
     if expected_size != raw_body_size:
         metrics.add_metric(name='MismatchedContentLength', unit=MetricUnit.Count, value=1)
         LOGGER.warning(
@@ -180,4 +418,20 @@ def handler(event: LambdaFunctionUrlEvent, _):
             raw_body_size
         )
 
-    send_to_sns(body)
+    return body
+
+
+@metrics.log_metrics
+@event_source(data_class=LambdaFunctionUrlEvent) # pylint:disable=no-value-for-parameter
+def handler(event: LambdaFunctionUrlEvent, _):
+    """Lambda function handler for processing incoming Push Notifications
+
+    Args:
+        event (LambdaFunctionUrlEvent): Incoming push notification from Google
+    """
+    received_time = time_now()
+    body = process_notification(event.headers, event.decoded_body, received_time)
+    if body:
+        send_to_sns(body)
+        # Only record the event once published, so redeliveries of failed events are not dropped
+        record_published(event.headers, body, received_time)
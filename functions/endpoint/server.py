@@ -0,0 +1,403 @@
+"""
+Standalone asyncio server to process incoming Push Notifications from Google
+
+This is an alternative to the Lambda function URL, for environments where one cannot be
+used. The same validation, application extraction, and metrics used by the Lambda function
+handler are applied to each notification, and bodies are published in batches using a
+pluggable sink (SNS, file, or a local queue).
+
+Note that notifications are acknowledged once they are queued for publishing. On SIGTERM or
+SIGINT, the server stops accepting notifications and publishes any that are still queued
+before exiting, but queued notifications are lost if the process is killed (eg: SIGKILL).
+
+Usage (from the functions directory):
+    python -m endpoint.server --port 8080 --sink sns
+"""
+import abc
+import argparse
+import asyncio
+from http import HTTPStatus
+import json
+import os
+import signal
+
+from aws_lambda_powertools.metrics import MetricUnit
+from botocore.config import Config
+
+from . import main
+
+LOGGER = main.LOGGER
+
+MAX_BODY_SIZE = 1024 * 1024  # bytes
+
+# SNS PublishBatch limits
+# Reference: https://docs.aws.amazon.com/sns/latest/api/API_PublishBatch.html
+SNS_MAX_BATCH_ENTRIES = 10
+SNS_MAX_BATCH_BYTES = 256 * 1024
+
+
+def _serialize(body: dict) -> str:
+    return json.dumps(body, separators=(',', ':'))
+
+
+class Sink(abc.ABC):
+    """Base class for destinations to which batches of notification bodies are published"""
+    @abc.abstractmethod
+    async def publish(self, bodies: list[dict]):
+        """Publish a batch of notification bodies
+
+        Args:
+            bodies (list[dict]): The notification bodies to publish
+        """
+
+    async def close(self):
+        """Release any resources held by this sink"""
+
+
+class SNSSink(Sink):
+    """Sink that publishes to an SNS topic using batch requests"""
+    def __init__(self, topic):
+        self._topic = topic
+
+    @staticmethod
+    def _batches(messages: list[str]):
+        batch = []
+        batch_size = 0
+        for message in messages:
+            size = len(message.encode())
+            if size > SNS_MAX_BATCH_BYTES:
+                # This message exceeds SNS limits and we cannot process it as-is
+                main.metrics.add_metric(name='DroppedEvents', unit=MetricUnit.Count, value=1)
+                continue
+
+            if len(batch) == SNS_MAX_BATCH_ENTRIES or batch_size + size > SNS_MAX_BATCH_BYTES:
+                yield batch
+                batch = []
+                batch_size = 0
+
+            batch.append(message)
+            batch_size += size
+
+        if batch:
+            yield batch
+
+    def _publish_batch(self, messages: list[str]) -> list[dict]:
+        response = self._topic.meta.client.publish_batch(
+            TopicArn=self._topic.arn,
+            PublishBatchRequestEntries=[
+                {'Id': str(i), 'Message': message} for i, message in enumerate(messages)
+            ],
+        )
+        return response.get('Failed', [])
+
+    async def publish(self, bodies: list[dict]):
+        loop = asyncio.get_running_loop()
+        for batch in self._batches([_serialize(body) for body in bodies]):
+            # boto3 is not asyncio aware, so publish from the default executor
+            failed = await loop.run_in_executor(None, self._publish_batch, batch)
+            for entry in failed:
+                LOGGER.error('Failed to publish message to sns: %s', entry)
+            if failed:
+                main.metrics.add_metric(
+                    name='DroppedEvents',
+                    unit=MetricUnit.Count,
+                    value=len(failed)
+                )
+
+        # Retries are recorded from the executor threads, so add them from the loop thread
+        main.add_retry_metrics()
+        if main.metrics.metric_set:
+            main.metrics.flush_metrics()
+
+        LOGGER.debug('Published %d messages to sns', len(bodies))
+
+
+class FileSink(Sink):
+    """Sink that appends notification bodies to a file, as newline delimited json"""
+    def __init__(self, path: str):
+        self._file = open(path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+
+    def _write(self, lines: str):
+        self._file.write(lines)
+        self._file.flush()
+
+    async def publish(self, bodies: list[dict]):
+        lines = ''.join(f'{_serialize(body)}\n' for body in bodies)
+        await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+
+    async def close(self):
+        self._file.close()
+
+
+class QueueSink(Sink):
+    """Sink that puts notification bodies onto a local asyncio queue for other consumers"""
+    def __init__(self, queue: asyncio.Queue):
+        self._queue = queue
+
+    async def publish(self, bodies: list[dict]):
+        for body in bodies:
+            await self._queue.put(body)
+
+
+class Batcher:  # pylint: disable=too-many-instance-attributes
+    """Collect notification bodies and publish them to a sink in batches
+
+    A batch is published once it reaches the maximum size, or once the first body
+    in the batch has waited for the maximum wait time
+    """
+    def __init__(self, sink: Sink, max_size: int = 10, max_wait: float = 0.05,
+                 max_inflight: int = 8):
+        self._sink = sink
+        self._max_size = max_size
+        self._max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._tasks = set()
+        self._batch = []
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        """True once the batcher has stopped, after which notifications are not accepted"""
+        return self._closed
+
+    def put(self, body: dict):
+        """Queue a notification body to be published
+
+        Args:
+            body (dict): The notification body
+        """
+        self._queue.put_nowait(body)
+
+    async def _fill_batch(self):
+        # The pending batch is kept on the instance until it is handed off for publishing,
+        # so it is not lost if cancelled while filling or waiting for an in-flight slot
+        self._batch.append(await self._queue.get())
+        deadline = asyncio.get_running_loop().time() + self._max_wait
+        while len(self._batch) < self._max_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _publish(self, batch: list[dict]):
+        try:
+            await self._sink.publish(batch)
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception('Failed to publish batch of %d notifications', len(batch))
+        finally:
+            self._inflight.release()
+
+    async def run(self):
+        """Publish batches until cancelled, then publish any remaining notifications"""
+        try:
+            while True:
+                await self._fill_batch()
+                await self._inflight.acquire()
+                batch, self._batch = self._batch, []
+                task = asyncio.create_task(self._publish(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            self._closed = True
+            remaining, self._batch = self._batch, []
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            for i in range(0, len(remaining), self._max_size):
+                await self._inflight.acquire()
+                await self._publish(remaining[i:i + self._max_size])
+            await asyncio.gather(*self._tasks)
+            await self._sink.close()
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple[str, dict, bytes] | None:
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None  # connection closed
+
+    method = request_line.decode('latin-1').split(' ', 1)[0]
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in {'\r\n', '\n', ''}:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    size = int(headers.get(main.HEADER_CONTENT_LENGTH, 0))
+    if size > MAX_BODY_SIZE:
+        raise ValueError(f'Request body too large: {size}')
+
+    body = await reader.readexactly(size) if size else b''
+
+    return method, headers, body
+
+
+def process_request(method: str, headers: dict, body: bytes, batcher: Batcher) -> HTTPStatus:
+    """Process a single request, queueing the notification body to be published if valid
+
+    Args:
+        method (str): The HTTP method of the request
+        headers (dict): The request headers, with lowercase names
+        body (bytes): The request body
+        batcher (Batcher): The batcher to which valid notification bodies are added
+    """
+    if method != 'POST':
+        return HTTPStatus.METHOD_NOT_ALLOWED
+
+    if batcher.closed:
+        # The server is stopping, so have Google redeliver this notification later
+        return HTTPStatus.SERVICE_UNAVAILABLE
+
+    received_time = main.time_now()
+    try:
+        notification = main.process_notification(
+            headers,
+            body.decode() if body else None,
+            received_time
+        )
+    except (KeyError, RuntimeError, TypeError, ValueError) as err:
+        # eg: missing token, invalid json, or a body that is not the expected structure
+        LOGGER.warning('Rejected invalid request: %r', err)
+        return HTTPStatus.BAD_REQUEST
+    finally:
+        # Metrics are flushed for each request, since the application dimension
+        # is specific to this notification
+        if main.metrics.metric_set:
+            main.metrics.flush_metrics()
+
+    if notification:
+        batcher.put(notification)
+        # Notifications are acknowledged once queued, so Google will not redeliver them
+        # even if publishing fails, and they can be recorded now
+        main.record_published(headers, notification, received_time)
+
+    return HTTPStatus.OK
+
+
+def _response(status: HTTPStatus, keep_alive: bool) -> bytes:
+    connection = 'keep-alive' if keep_alive else 'close'
+    return (
+        f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+        f'Content-Length: 0\r\nConnection: {connection}\r\n\r\n'
+    ).encode()
+
+
+async def _handle_connection(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        batcher: Batcher):
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except ValueError as err:
+                LOGGER.warning('Rejected invalid request: %s', err)
+                writer.write(_response(HTTPStatus.BAD_REQUEST, keep_alive=False))
+                await writer.drain()
+                break
+
+            if not request:
+                break
+
+            method, headers, body = request
+            try:
+                status = process_request(method, headers, body, batcher)
+            except Exception:  # pylint: disable=broad-exception-caught
+                # Always respond, so the client is not left waiting for a response
+                LOGGER.exception('Failed to process request')
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write(_response(status, keep_alive))
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError) as err:
+        LOGGER.debug('Connection closed: %s', err)
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, batcher: Batcher):
+    """Serve requests until cancelled
+
+    SIGTERM and SIGINT cancel serving, so queued notifications are published before exiting
+
+    Args:
+        host (str): The address on which to listen
+        port (int): The port on which to listen
+        batcher (Batcher): The batcher used to publish notification bodies
+    """
+    loop = asyncio.get_running_loop()
+    serve_task = asyncio.current_task()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, serve_task.cancel)
+
+    batcher_task = asyncio.create_task(batcher.run())
+
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_connection(reader, writer, batcher),
+        host,
+        port,
+    )
+
+    LOGGER.info('Listening on %s', ', '.join(str(sock.getsockname()) for sock in server.sockets))
+
+    try:
+        await server.serve_forever()
+    finally:
+        # Connections that are still open are not waited for, since any requests
+        # received once the batcher is closed are rejected
+        server.close()
+        batcher_task.cancel()
+        await asyncio.gather(batcher_task, return_exceptions=True)
+        LOGGER.info('Stopped server')
+
+
+def _sink_from_args(args: argparse.Namespace) -> Sink:
+    if args.sink == 'file':
+        return FileSink(args.path)
+
+    if 'SNS_TOPIC_ARN' not in os.environ:
+        raise RuntimeError('SNS_TOPIC_ARN must be set to use the sns sink')
+
+    # Unlike the Lambda function, batches are published concurrently from the default
+    # executor, so size the connection pool for every in-flight publish
+    config = main.CLIENT_CONFIG.merge(Config(max_pool_connections=args.max_inflight))
+
+    return SNSSink(main.sns_topic(os.environ['SNS_TOPIC_ARN'], config))
+
+
+def run():
+    """Parse command line arguments and run the server"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)))
+    parser.add_argument('--sink', choices=['sns', 'file'], default='sns')
+    parser.add_argument('--path', default='notifications.json', help='output path for file sink')
+    parser.add_argument('--max-batch-size', type=int, default=SNS_MAX_BATCH_ENTRIES)
+    parser.add_argument('--max-batch-wait', type=float, default=0.05, help='seconds')
+    parser.add_argument('--max-inflight', type=int, default=8, help='concurrent publishes')
+    args = parser.parse_args()
+
+    batcher = Batcher(
+        _sink_from_args(args),
+        args.max_batch_size,
+        args.max_batch_wait,
+        args.max_inflight,
+    )
+
+    try:
+        asyncio.run(serve(args.host, args.port, batcher))
+    except asyncio.CancelledError:
+        pass  # stopped by a signal
+
+
+if __name__ == '__main__':
+    run()
@@ -1,7 +1,12 @@
 # pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring,line-too-long,protected-access,attribute-defined-outside-init
+import json
 import os
 from unittest import mock
 
+import boto3
+from moto import mock_aws
+import pytest
+
 from .. import TEST_TOKEN
 
 TEST_APP_NAME = 'foo_app'
@@ -55,3 +60,183 @@ class TestChanneler:
             'resource_id': 'o3hgv1538sdjfh',
             'channel_id': '26706b83-ab7a-49a9-a0cd-8c9b723df9a2',
         }
+
+
+class TestHandler:
+
+    def setup_method(self):
+        self._env = mock.patch.dict(os.environ, {
+            'SECRET_NAME': 'foo-secret',
+            'DELEGATION_EMAIL': 'foo@bar.com',
+            'LAMBDA_URL': TEST_URL,
+            'CHANNEL_TOKEN': TEST_TOKEN,
+        })
+        self._env.start()
+        self._channeler = mock.patch.object(main, 'Channeler').start()
+        mock.patch.object(main, '_get_secrets', return_value={}).start()
+        self._init_sfn = mock.patch.object(main, '_init_step_function').start()
+        self._stop_sfn = mock.patch.object(main, '_stop_step_function').start()
+        self._lease = main.LocalLease(300)
+        mock.patch.object(main, '_get_lease', return_value=self._lease).start()
+        self._context = mock.Mock(aws_request_id='request-id')
+        self._context.get_remaining_time_in_millis.return_value = 30000
+
+    def teardown_method(self):
+        mock.patch.stopall()
+        self._env.stop()
+
+    def test_recover_from_failure(self):
+        old_input = {'application': TEST_APP_NAME, 'resource_id': 'old-resource', 'channel_id': 'old-chan'}
+        main.handler({'lambda_action': 'recover', 'input': json.dumps(old_input)}, self._context)
+
+        channel_info = self._channeler.return_value.create_channel.return_value
+        self._init_sfn.assert_called_with(channel_info)
+        self._stop_sfn.assert_not_called()
+        self._channeler.return_value.stop_channel.assert_called_with('old-resource', 'old-chan')
+
+    def test_recover_from_watchdog(self):
+        main.handler({'lambda_action': 'recover', 'application': TEST_APP_NAME}, self._context)
+
+        channel_info = self._channeler.return_value.create_channel.return_value
+        self._stop_sfn.assert_called_with(self._channeler.return_value, TEST_APP_NAME)
+        self._init_sfn.assert_called_with(channel_info)
+        self._channeler.return_value.stop_channel.assert_not_called()
+
+    def test_lease_held(self):
+        self._lease.acquire(TEST_APP_NAME, 'other-request-id')
+        result = main.handler({'lambda_action': 'init', 'application': TEST_APP_NAME}, self._context)
+
+        assert result == {'application': TEST_APP_NAME, 'skipped': True}
+        self._channeler.return_value.create_channel.assert_not_called()
+        self._init_sfn.assert_not_called()
+
+    def test_lease_held_step_function(self):
+        self._lease.acquire(TEST_APP_NAME, 'other-request-id')
+        event = {'application': TEST_APP_NAME, 'resource_id': 'old-resource', 'channel_id': 'old-chan'}
+        with pytest.raises(main.LeaseHeldError):
+            main.handler(event, self._context)
+
+        self._channeler.return_value.create_channel.assert_not_called()
+        self._channeler.return_value.stop_channel.assert_not_called()
+        # the lease is still held by the other invocation
+        assert not self._lease.acquire(TEST_APP_NAME, 'request-id')
+
+    def test_lease_held_stop(self):
+        self._lease.acquire(TEST_APP_NAME, 'other-request-id')
+
+        def _sleep(_):
+            # the renewal in progress finishes while waiting
+            self._lease.release(TEST_APP_NAME, 'other-request-id')
+
+        with mock.patch.object(main.time, 'sleep', side_effect=_sleep):
+            main.handler({'lambda_action': 'stop', 'application': TEST_APP_NAME}, self._context)
+
+        self._stop_sfn.assert_called_with(self._channeler.return_value, TEST_APP_NAME)
+        assert self._lease.acquire(TEST_APP_NAME, 'other-request-id')  # released after stopping
+
+    def test_lease_held_stop_timeout(self):
+        self._lease.acquire(TEST_APP_NAME, 'other-request-id')
+        self._context.get_remaining_time_in_millis.side_effect = [20000, 15000, 5000]
+        with mock.patch.object(main.time, 'sleep'), pytest.raises(main.LeaseHeldError):
+            main.handler({'lambda_action': 'stop', 'application': TEST_APP_NAME}, self._context)
+
+        self._stop_sfn.assert_not_called()
+
+    def test_lease_released(self):
+        main.handler({'lambda_action': 'init', 'application': TEST_APP_NAME}, self._context)
+
+        self._init_sfn.assert_called_once()
+        assert self._lease.acquire(TEST_APP_NAME, 'other-request-id')
+
+
+def test_stop_step_function():
+    executions = [
+        {'name': f'{TEST_APP_NAME}_26706b83-ab7a-49a9-a0cd-8c9b723df9a2', 'executionArn': 'arn-1'},
+        {'name': f'{TEST_APP_NAME}_enterprise_e4c7d5a0-1b2f-4c3d-9e8f-7a6b5c4d3e2f', 'executionArn': 'arn-2'},
+    ]
+    channeler = mock.Mock()
+    with mock.patch.dict(os.environ, {'STATE_MACHINE_ARN': 'foo-arn'}), \
+            mock.patch.object(main, '_client') as client_mock:
+        sfn_client = client_mock.return_value
+        sfn_client.get_paginator.return_value.paginate.return_value = [{'executions': executions}]
+        sfn_client.describe_execution.return_value = {
+            'input': json.dumps({'resource_id': 'resource-id', 'channel_id': 'chan-id'})
+        }
+        main._stop_step_function(channeler, TEST_APP_NAME)
+
+    sfn_client.stop_execution.assert_called_once_with(
+        executionArn='arn-1',
+        error='ManualStop',
+        cause='received request to stop step function'
+    )
+    channeler.stop_channel.assert_called_once_with('resource-id', 'chan-id')
+
+
+def test_lease_abstract():
+    class PartialLease(main.Lease):  # pylint: disable=abstract-method
+        def acquire(self, key, owner):
+            return True
+
+    with pytest.raises(TypeError):
+        PartialLease(300)  # pylint: disable=abstract-class-instantiated
+
+
+class TestLocalLease:
+
+    def test_acquire(self):
+        lease = main.LocalLease(300)
+        assert lease.acquire(TEST_APP_NAME, 'owner-1')
+        assert lease.acquire(TEST_APP_NAME, 'owner-1')  # idempotent for the same owner
+        assert not lease.acquire(TEST_APP_NAME, 'owner-2')
+        assert lease.acquire('other_app', 'owner-2')
+
+    def test_release(self):
+        lease = main.LocalLease(300)
+        lease.acquire(TEST_APP_NAME, 'owner-1')
+        lease.release(TEST_APP_NAME, 'owner-2')  # not the owner, so no-op
+        assert not lease.acquire(TEST_APP_NAME, 'owner-2')
+        lease.release(TEST_APP_NAME, 'owner-1')
+        assert lease.acquire(TEST_APP_NAME, 'owner-2')
+
+    def test_expired(self):
+        lease = main.LocalLease(-1)
+        assert lease.acquire(TEST_APP_NAME, 'owner-1')
+        assert lease.acquire(TEST_APP_NAME, 'owner-2')
+
+
+@pytest.fixture(name='lease_table')
+def fixture_lease_table():
+    with mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': 'us-east-1'}), mock_aws():
+        main._client.cache_clear()
+        boto3.client('dynamodb').create_table(
+            TableName='foo-leases',
+            KeySchema=[{'AttributeName': 'application', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'application', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        yield 'foo-leases'
+
+
+def test_dynamodb_lease(lease_table):
+    lease = main.DynamoDBLease(lease_table, 300)
+    assert lease.acquire(TEST_APP_NAME, 'owner-1')
+    assert lease.acquire(TEST_APP_NAME, 'owner-1')
+    assert not lease.acquire(TEST_APP_NAME, 'owner-2')
+    lease.release(TEST_APP_NAME, 'owner-2')  # not the owner, so no-op
+    assert not lease.acquire(TEST_APP_NAME, 'owner-2')
+    lease.release(TEST_APP_NAME, 'owner-1')
+    assert lease.acquire(TEST_APP_NAME, 'owner-2')
+
+
+def test_dynamodb_lease_expired(lease_table):
+    assert main.DynamoDBLease(lease_table, -1).acquire(TEST_APP_NAME, 'owner-1')
+    assert main.DynamoDBLease(lease_table, 300).acquire(TEST_APP_NAME, 'owner-2')
+
+
+def test_client_cached():
+    with mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': 'us-east-1'}):
+        main._client.cache_clear()
+        client = main._client('stepfunctions')
+        assert main._client('stepfunctions') is client
+        assert client.meta.config.retries['mode'] == 'adaptive'
+        main._client.cache_clear()
@@ -1,4 +1,4 @@
-# pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring,line-too-long
+# pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring,line-too-long,protected-access,attribute-defined-outside-init
 from datetime import datetime, timezone
 import json
 import logging
@@ -90,6 +90,21 @@ class TestEndpoint:
 
         assert 'Found mismatched content-length (10) and body size (71)' in caplog.text
 
+    def test_non_ascii_size(self, caplog, sns):  # pylint: disable=unused-argument
+        body = '{"id": {"applicationName": "admin"}, "actor": {"email": "jos\u00e9@bar.com"}}'
+        main.handler(
+            {
+                'headers': {
+                    main.HEADER_CHANNEL_TOKEN: TEST_TOKEN,
+                    main.HEADER_CONTENT_LENGTH: len(body.encode()),
+                },
+                'body': body
+            },
+            None
+        )
+
+        assert 'Found mismatched content-length' not in caplog.text
+
     def test_invalid_body(self):
         with pytest.raises(json.JSONDecodeError):
             main.handler(
@@ -189,3 +204,162 @@ def test_send_to_sns():
         )
         main.send_to_sns({})
         metric_mock.assert_called_with(name='DroppedEvents', unit=MetricUnit.Count, value=1)
+
+
+@pytest.mark.parametrize('retries, called', [(0, False), (2, True)])
+def test_record_retries(retries, called):
+    with mock.patch.object(Metrics, 'add_metric') as metric_mock:
+        main._record_retries({'ResponseMetadata': {'RetryAttempts': retries}})
+        main._record_retries({'ResponseMetadata': {'RetryAttempts': retries}})
+        metric_mock.assert_not_called()
+
+        main.add_retry_metrics()
+        if called:
+            metric_mock.assert_called_once_with(
+                name='ClientRetries', unit=MetricUnit.Count, value=retries * 2
+            )
+        else:
+            metric_mock.assert_not_called()
+
+
+@pytest.mark.parametrize('body, key', [
+    ({'id': {'time': '2022-07-27T06:30:00.000Z', 'uniqueQualifier': '1234567890'}}, '2022-07-27T06:30:00.000Z:1234567890'),
+    ({'id': {'time': '2022-07-27T06:30:00.000Z'}}, None),
+    ({}, None),
+])
+def test_event_key(body, key):
+    assert main.event_key(body) == key
+
+
+@pytest.mark.parametrize('rate, sampled', [(0, False), (1, True)])
+def test_is_sampled(rate, sampled):
+    with mock.patch.object(main, 'DEBUG_SAMPLE_RATE', rate):
+        assert main.is_sampled('2022-07-27T06:30:00.000Z:1234567890') == sampled
+        assert not main.is_sampled(None)
+
+
+def test_is_sampled_deterministic():
+    keys = [f'2022-07-27T06:30:00.000Z:{i}' for i in range(1000)]
+    with mock.patch.object(main, 'DEBUG_SAMPLE_RATE', 0.1):
+        first = [main.is_sampled(key) for key in keys]
+        assert first == [main.is_sampled(key) for key in keys]
+        assert 50 < sum(first) < 150
+
+
+@pytest.mark.parametrize('level, rate, expected', [
+    (logging.DEBUG, 0, logging.DEBUG),
+    (logging.INFO, 1, logging.INFO),
+    (logging.INFO, 0, None),
+])
+def test_sampled_level(level, rate, expected, caplog):
+    caplog.set_level(level, logger=main.LOGGER.name)
+    with mock.patch.object(main, 'DEBUG_SAMPLE_RATE', rate):
+        assert main.sampled_level('foo-key') == expected
+    assert main.LOGGER.level == level  # the logger level is never changed
+
+
+EXPIRATIONS = {
+    'chan-1': 'Wed, 27 Jul 2022 10:00:00 GMT',
+    'chan-2': 'Wed, 27 Jul 2022 16:00:00 GMT',
+    'chan-3': 'Wed, 27 Jul 2022 16:00:00 GMT',
+}
+
+
+class TestChannelTracker:
+
+    def setup_method(self):
+        self._tracker = main.ChannelTracker(60)
+
+    def _deliver(self, app_name, channel_id, key, now, published=True):
+        """Check an event for duplication, and record it as published if it is not a duplicate"""
+        if self._tracker.is_duplicate(app_name, channel_id, EXPIRATIONS[channel_id], key, now):
+            return True
+        if published:
+            self._tracker.record(app_name, channel_id, key, now)
+        return False
+
+    def test_no_overlap(self):
+        assert not self._deliver('admin', 'chan-1', 'key-1', 0)
+        # the same key on the same channel is not suppressed outside of an overlap
+        assert not self._deliver('admin', 'chan-1', 'key-1', 1)
+
+    def test_overlap(self):
+        assert not self._deliver('admin', 'chan-1', 'key-1', 0)
+        assert not self._deliver('admin', 'chan-2', 'key-2', 1)
+        assert self._deliver('admin', 'chan-2', 'key-1', 2)
+        assert self._deliver('admin', 'chan-1', 'key-2', 3)
+        # other applications are tracked separately
+        assert not self._deliver('drive', 'chan-3', 'key-1', 4)
+
+    def test_overlap_redelivery_same_channel(self):
+        assert not self._deliver('admin', 'chan-1', 'key-1', 0)
+        assert not self._deliver('admin', 'chan-2', 'key-2', 1)
+        # Google retries events that failed to publish on the same channel
+        assert not self._deliver('admin', 'chan-2', 'key-2', 5)
+        assert not self._deliver('admin', 'chan-1', 'key-1', 5)
+
+    def test_overlap_unpublished(self):
+        assert not self._deliver('admin', 'chan-1', 'key-1', 0)
+        assert not self._deliver('admin', 'chan-2', 'key-2', 1, published=False)
+        # the event failed to publish on chan-2, so its delivery on chan-1 is not a duplicate
+        assert not self._deliver('admin', 'chan-1', 'key-2', 2)
+
+    def test_overlap_expired(self):
+        assert not self._deliver('admin', 'chan-1', 'key-1', 0)
+        assert not self._deliver('admin', 'chan-2', 'key-2', 1)
+        assert not self._deliver('admin', 'chan-2', 'key-1', 61)
+        assert not self._deliver('admin', 'chan-1', 'key-2', 120)
+
+    def test_missing_values(self):
+        assert not self._tracker.is_duplicate('admin', None, None, 'key-1', 0)
+        assert not self._tracker.is_duplicate('admin', 'chan-1', None, None, 0)
+        self._tracker.record('admin', None, 'key-1', 0)
+        self._tracker.record('admin', 'chan-1', None, 0)
+        assert not self._tracker._seen.get('admin')
+
+
+def test_process_notification_duplicate():
+    body = '{"id": {"applicationName": "admin", "time": "2022-07-27T06:30:00.000Z", "uniqueQualifier": "1"}}'
+    headers = {
+        main.HEADER_CHANNEL_TOKEN: TEST_TOKEN,
+        main.HEADER_CONTENT_LENGTH: str(len(body)),
+    }
+    with mock.patch.object(main, 'CHANNEL_TRACKER', main.ChannelTracker(60)), \
+            mock.patch.object(Metrics, 'add_metric') as metric_mock:
+        chan_1_headers = {**headers, main.HEADER_CHANNEL_ID: 'chan-1', main.HEADER_CHANNEL_EXPIRATION: EXPIRATIONS['chan-1']}
+        published = main.process_notification(chan_1_headers, body, MOCK_RECEIVED_TIME)
+        main.record_published(chan_1_headers, published, MOCK_RECEIVED_TIME)
+        assert main.process_notification(
+            {**headers, main.HEADER_CHANNEL_ID: 'chan-2', main.HEADER_CHANNEL_EXPIRATION: EXPIRATIONS['chan-2']},
+            body,
+            MOCK_RECEIVED_TIME,
+        ) is None
+        metric_mock.assert_called_with(name='SuppressedDuplicates', unit=MetricUnit.Count, value=1)
+
+
+def test_handler_publish_failed(env_vars):  # pylint: disable=unused-argument
+    body = '{"id": {"applicationName": "admin", "time": "2022-07-27T06:30:00.000Z", "uniqueQualifier": "1"}}'
+    headers = {
+        main.HEADER_CHANNEL_TOKEN: TEST_TOKEN,
+        main.HEADER_CONTENT_LENGTH: str(len(body)),
+    }
+
+    def _event(channel_id):
+        return {
+            'headers': {**headers, main.HEADER_CHANNEL_ID: channel_id, main.HEADER_CHANNEL_EXPIRATION: EXPIRATIONS[channel_id]},
+            'body': body,
+        }
+
+    with mock.patch.object(main, 'CHANNEL_TRACKER', main.ChannelTracker(60)), \
+            mock.patch.object(main, 'send_to_sns') as send_mock:
+        main.handler(_event('chan-1'), None)
+        main.handler(_event('chan-2'), None)  # duplicate on the new channel is suppressed
+        assert send_mock.call_count == 1
+
+        send_mock.side_effect = [RuntimeError('timed out'), None]
+        body = body.replace('"1"', '"2"')
+        with pytest.raises(RuntimeError):
+            main.handler(_event('chan-2'), None)
+        # the event was not published, so its redelivery is not suppressed
+        main.handler(_event('chan-1'), None)
+        assert send_mock.call_count == 3
@@ -0,0 +1,271 @@
+# pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring,line-too-long,protected-access
+import asyncio
+from http import HTTPStatus
+import json
+import os
+import signal
+from unittest import mock
+
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+import pytest
+
+from .. import TEST_TOKEN
+
+ENV = {
+    'PREFIX': 'foo',
+    'CHANNEL_TOKEN': TEST_TOKEN,
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'POWERTOOLS_METRICS_NAMESPACE': 'gsuite-logs-channeler',
+}
+
+with mock.patch.dict(os.environ, ENV):
+    from endpoint import main, server
+
+BODY = '{"id": {"applicationName": "admin"}, "actor": {"email": "foo@bar.com"}}'
+HEADERS = {
+    main.HEADER_CHANNEL_TOKEN: TEST_TOKEN,
+    main.HEADER_CONTENT_LENGTH: str(len(BODY)),
+}
+
+
+class RecordingSink(server.Sink):
+
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    async def publish(self, bodies):
+        self.batches.append(bodies)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('method, headers, body, status, queued', [
+    ('POST', HEADERS, BODY.encode(), HTTPStatus.OK, True),
+    ('GET', HEADERS, BODY.encode(), HTTPStatus.METHOD_NOT_ALLOWED, False),
+    ('POST', {main.HEADER_CHANNEL_TOKEN: 'bad-token'}, BODY.encode(), HTTPStatus.BAD_REQUEST, False),
+    ('POST', {main.HEADER_CHANNEL_TOKEN: TEST_TOKEN}, b'bad json', HTTPStatus.BAD_REQUEST, False),
+    ('POST', {main.HEADER_CHANNEL_TOKEN: TEST_TOKEN}, b'{"actor": {}}', HTTPStatus.BAD_REQUEST, False),
+    ('POST', {main.HEADER_CHANNEL_TOKEN: TEST_TOKEN}, b'[1]', HTTPStatus.BAD_REQUEST, False),
+    ('POST', {main.HEADER_CHANNEL_TOKEN: TEST_TOKEN, main.HEADER_RESOURCE_STATE: 'sync'}, b'', HTTPStatus.OK, False),
+])
+def test_process_request(method, headers, body, status, queued):
+    batcher = mock.Mock(closed=False)
+    with mock.patch.object(Metrics, 'flush_metrics'):
+        assert server.process_request(method, headers, body, batcher) == status
+    assert batcher.put.called == queued
+
+
+def test_batcher():
+    sink = RecordingSink()
+
+    async def _run():
+        batcher = server.Batcher(sink, max_size=10, max_wait=0.01)
+        task = asyncio.create_task(batcher.run())
+        for i in range(25):
+            batcher.put({'id': i})
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(_run())
+
+    assert [len(batch) for batch in sink.batches] == [10, 10, 5]
+    assert sink.closed
+
+
+def test_batcher_drains_on_cancel():
+    sink = RecordingSink()
+
+    async def _run():
+        batcher = server.Batcher(sink, max_size=10, max_wait=10)
+        task = asyncio.create_task(batcher.run())
+        for i in range(5):
+            batcher.put({'id': i})
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(_run())
+
+    assert [item['id'] for batch in sink.batches for item in batch] == [0, 1, 2, 3, 4]
+
+
+def test_batcher_drains_waiting_batch_on_cancel():
+    sink = RecordingSink()
+    publish = sink.publish
+
+    async def _slow_publish(bodies):
+        await asyncio.sleep(0.05)
+        await publish(bodies)
+
+    sink.publish = _slow_publish
+
+    async def _run():
+        # The second batch waits for the only in-flight slot when cancelled
+        batcher = server.Batcher(sink, max_size=1, max_wait=0, max_inflight=1)
+        task = asyncio.create_task(batcher.run())
+        for i in range(3):
+            batcher.put({'id': i})
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(_run())
+
+    assert [item['id'] for batch in sink.batches for item in batch] == [0, 1, 2]
+
+
+def test_sink_from_args():
+    args = mock.Mock(sink='sns', max_inflight=8)
+    with mock.patch.dict(os.environ, {**ENV, 'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:123456789012:foo-topic'}):
+        sink = server._sink_from_args(args)
+
+    # The server uses its own client, with a connection for each in-flight publish
+    assert sink._topic.meta.client.meta.config.max_pool_connections == 8
+    assert sink._topic is not main.SNS_TOPIC
+
+
+def test_sink_abstract():
+    class PartialSink(server.Sink):  # pylint: disable=abstract-method
+        async def close(self):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialSink()  # pylint: disable=abstract-class-instantiated
+
+
+def test_sns_sink():
+    topic = mock.Mock(arn='arn:aws:sns:us-east-1:123456789012:foo-topic')
+    topic.meta.client.publish_batch.return_value = {'Successful': [], 'Failed': [{'Id': '0'}]}
+
+    with mock.patch.object(Metrics, 'add_metric') as metric_mock, \
+            mock.patch.object(Metrics, 'flush_metrics'):
+        asyncio.run(server.SNSSink(topic).publish([{'id': i} for i in range(15)]))
+
+    assert topic.meta.client.publish_batch.call_count == 2
+    metric_mock.assert_called_with(name='DroppedEvents', unit=MetricUnit.Count, value=1)
+
+
+def test_sns_sink_retries():
+    topic = mock.Mock(arn='arn:aws:sns:us-east-1:123456789012:foo-topic')
+    topic.meta.client.publish_batch.side_effect = lambda **_: (
+        main._record_retries({'ResponseMetadata': {'RetryAttempts': 1}}) or {'Failed': []}
+    )
+
+    with mock.patch.object(Metrics, 'add_metric') as metric_mock, \
+            mock.patch.object(Metrics, 'flush_metrics'):
+        asyncio.run(server.SNSSink(topic).publish([{'id': i} for i in range(15)]))
+
+    metric_mock.assert_called_once_with(name='ClientRetries', unit=MetricUnit.Count, value=2)
+
+
+def test_sns_sink_batches():
+    messages = ['x' * 100 * 1024] * 3 + ['y' * 300 * 1024]
+    with mock.patch.object(Metrics, 'add_metric') as metric_mock:
+        assert [len(batch) for batch in server.SNSSink._batches(messages)] == [2, 1]
+    metric_mock.assert_called_with(name='DroppedEvents', unit=MetricUnit.Count, value=1)
+
+
+def test_server(caplog):  # pylint: disable=unused-argument
+    queue = asyncio.Queue()
+
+    async def _run():
+        batcher = server.Batcher(server.QueueSink(queue), max_wait=0.01)
+        batcher_task = asyncio.create_task(batcher.run())
+        srv = await asyncio.start_server(
+            lambda reader, writer: server._handle_connection(reader, writer, batcher),
+            '127.0.0.1',
+            0,
+        )
+        port = srv.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        request = (
+            'POST / HTTP/1.1\r\n'
+            f'{main.HEADER_CHANNEL_TOKEN}: {TEST_TOKEN}\r\n'
+            f'Content-Length: {len(BODY)}\r\n'
+            '\r\n'
+            f'{BODY}'
+        ).encode()
+
+        # Send two requests on the same connection
+        responses = []
+        for _ in range(2):
+            writer.write(request)
+            await writer.drain()
+            responses.append(await reader.readuntil(b'\r\n\r\n'))
+
+        writer.close()
+        published = [await asyncio.wait_for(queue.get(), 1) for _ in range(2)]
+
+        srv.close()
+        await srv.wait_closed()
+        batcher_task.cancel()
+        await asyncio.gather(batcher_task, return_exceptions=True)
+
+        return responses, published
+
+    with mock.patch.object(Metrics, 'flush_metrics'):
+        responses, published = asyncio.run(_run())
+
+    assert all(response.startswith(b'HTTP/1.1 200 OK') for response in responses)
+    assert published == [json.loads(BODY)] * 2
+
+
+def test_process_request_closed():
+    batcher = mock.Mock(closed=True)
+    assert server.process_request('POST', HEADERS, BODY.encode(), batcher) == HTTPStatus.SERVICE_UNAVAILABLE
+    batcher.put.assert_not_called()
+
+
+@pytest.mark.parametrize('sig', [signal.SIGTERM, signal.SIGINT])
+def test_serve_signal(sig):
+    sink = RecordingSink()
+
+    async def _run():
+        # The batch would not be published for some time if the batcher was not drained
+        batcher = server.Batcher(sink, max_wait=60)
+        serve_task = asyncio.create_task(server.serve('127.0.0.1', 0, batcher))
+        await asyncio.sleep(0.05)  # allow the signal handlers to be installed
+
+        batcher.put(json.loads(BODY))
+        await asyncio.sleep(0.01)
+        os.kill(os.getpid(), sig)
+
+        await asyncio.gather(serve_task, return_exceptions=True)
+        return serve_task.cancelled()
+
+    with mock.patch.object(Metrics, 'flush_metrics'):
+        assert asyncio.run(_run())
+
+    assert sink.batches == [[json.loads(BODY)]]
+    assert sink.closed
+
+
+def test_handle_connection_error():
+    async def _run():
+        batcher = server.Batcher(server.QueueSink(asyncio.Queue()))
+        srv = await asyncio.start_server(
+            lambda reader, writer: server._handle_connection(reader, writer, batcher),
+            '127.0.0.1',
+            0,
+        )
+        port = srv.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'POST / HTTP/1.1\r\nContent-Length: {len(BODY)}\r\n\r\n{BODY}'.encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+
+        writer.close()
+        srv.close()
+        await srv.wait_closed()
+        return response
+
+    with mock.patch.object(server, 'process_request', side_effect=AttributeError('unexpected')):
+        response = asyncio.run(_run())
+
+    assert response.startswith(b'HTTP/1.1 500 Internal Server Error')
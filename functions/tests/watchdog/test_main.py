@@ -0,0 +1,174 @@
+# pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring,line-too-long,protected-access
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from unittest import mock
+
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+import pytest
+
+MOCK_NOW = datetime(2022, 7, 27, 7, 0, 0, tzinfo=timezone.utc)
+ENV = {
+    'PREFIX': 'foo',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'POWERTOOLS_METRICS_NAMESPACE': 'gsuite-logs-channeler',
+    'APPLICATIONS': json.dumps(['admin', 'drive']),
+    'WINDOW_MINUTES': '60',
+    'LOOKBACK_DAYS': '7',
+    'THRESHOLD': '0.001',
+    'STATE_MACHINE_ARN': 'arn:aws:states:us-east-1:123456789012:stateMachine:foo',
+    'CHANNEL_RENEWER_FUNCTION': 'foo-renewer',
+}
+
+with mock.patch.dict(os.environ, ENV):
+    from watchdog import main
+
+
+@pytest.fixture(name='env_vars')
+def fixture_env_vars():
+    with mock.patch.dict(os.environ, ENV):
+        yield
+
+
+@pytest.fixture(name='static_time_now')
+def fixture_static_time_now():
+    with mock.patch.object(main, 'time_now') as time_mock:
+        time_mock.return_value = MOCK_NOW
+        yield time_mock
+
+
+def _arrivals(count, end=MOCK_NOW, days=8) -> list[tuple[datetime, float]]:
+    """Build arrivals with one count per period, ending at the end time
+
+    The count may be a function of the period's timestamp
+    """
+    periods = days * 24 * 3600 // main.METRIC_PERIOD
+    timestamps = [end - timedelta(seconds=main.METRIC_PERIOD * (periods - i)) for i in range(periods)]
+    return [
+        (timestamp, count(timestamp) if callable(count) else count)
+        for timestamp in timestamps
+    ]
+
+
+def _working_hours(timestamp):
+    return 10 if 9 <= timestamp.hour < 18 else 0
+
+
+def _silent_since(silent_start):
+    return lambda timestamp: 0 if timestamp >= silent_start else 10
+
+
+@pytest.mark.parametrize('now, count, silent', [
+    (MOCK_NOW, _silent_since(MOCK_NOW - timedelta(minutes=60)), True),  # steady baseline, silent for the window
+    (MOCK_NOW, 10, False),  # events in the window
+    (MOCK_NOW, lambda timestamp: 1 if timestamp.hour == 6 and timestamp.minute == 0 else 0, False),  # not enough baseline events
+    (MOCK_NOW, _working_hours, False),  # outside of working hours, silence is expected
+    (MOCK_NOW.replace(hour=12), _working_hours, False),  # events in the window during working hours
+    (
+        MOCK_NOW.replace(hour=12),
+        lambda timestamp: 0 if timestamp >= MOCK_NOW.replace(hour=11) else _working_hours(timestamp),
+        True,
+    ),  # silent during working hours
+])
+def test_is_silent(now, count, silent):
+    window_start = now - timedelta(minutes=60)
+    with mock.patch.object(main, 'time_now', return_value=now):
+        assert main.is_silent(_arrivals(count, end=now), window_start, 7, 0.001) == silent
+
+
+def test_is_silent_overnight():
+    """An application only active during working hours is never silent overnight"""
+    for hour in range(24):
+        now = MOCK_NOW.replace(hour=hour)
+        if 9 <= hour < 18:
+            continue
+        with mock.patch.object(main, 'time_now', return_value=now):
+            assert not main.is_silent(
+                _arrivals(_working_hours, end=now),
+                now - timedelta(minutes=60),
+                7,
+                0.001
+            )
+
+
+@pytest.mark.parametrize('recovery_ages, event_age, backoff', [
+    ([], 180, False),  # never recovered
+    ([30], 180, True),  # recovered within 2 windows
+    ([150], 180, False),  # recovered more than 2 windows ago
+    ([150, 170], 180, True),  # second consecutive recovery waits for 4 windows
+    ([250, 170], 180, False),  # only the recovery since the last event is counted
+    ([30], 10, False),  # events were received since the recovery
+])
+def test_in_backoff(recovery_ages, event_age, backoff, static_time_now):  # pylint: disable=unused-argument
+    arrivals = [(MOCK_NOW - timedelta(minutes=event_age), 10)]
+    recoveries = [(MOCK_NOW - timedelta(minutes=age), 1) for age in recovery_ages]
+    assert main.in_backoff(arrivals, recoveries, timedelta(minutes=60)) == backoff
+
+
+@pytest.mark.parametrize('app_name, query_id', [
+    ('admin', 'app_admin'),
+    ('google_chat', 'app_google_chat'),
+    ('data-studio', 'app_data_studio'),
+])
+def test_query_id(app_name, query_id):
+    assert main._query_id(app_name) == query_id
+
+
+def test_handler(env_vars, static_time_now):  # pylint: disable=unused-argument
+    arrivals = {
+        'admin': _arrivals(_silent_since(MOCK_NOW - timedelta(minutes=60))),
+        'drive': _arrivals(10),
+    }
+    with mock.patch.object(main, 'get_counts', side_effect=[arrivals, {'admin': [], 'drive': []}]), \
+            mock.patch.object(main, '_recently_renewed', return_value=set()), \
+            mock.patch.object(main, '_recover') as recover_mock, \
+            mock.patch.object(Metrics, 'add_metric') as metric_mock:
+        main.handler({}, None)
+
+    recover_mock.assert_called_once_with('admin')
+    metric_mock.assert_called_with(name='SilentApplications', unit=MetricUnit.Count, value=1)
+
+
+def test_handler_recently_renewed(env_vars, static_time_now):  # pylint: disable=unused-argument
+    arrivals = {
+        'admin': _arrivals(_silent_since(MOCK_NOW - timedelta(minutes=60))),
+        'drive': _arrivals(10),
+    }
+    with mock.patch.object(main, 'get_counts', side_effect=[arrivals, {'admin': [], 'drive': []}]), \
+            mock.patch.object(main, '_recently_renewed', return_value={'admin'}), \
+            mock.patch.object(main, '_recover') as recover_mock:
+        main.handler({}, None)
+
+    recover_mock.assert_not_called()
+
+
+def test_handler_silent_after_recovery(env_vars, static_time_now):  # pylint: disable=unused-argument
+    arrivals = {
+        'admin': _arrivals(_silent_since(MOCK_NOW - timedelta(minutes=150))),
+        'drive': _arrivals(10),
+    }
+    # recovered 90 minutes ago, and still silent
+    recoveries = {'admin': [(MOCK_NOW - timedelta(minutes=90), 1)], 'drive': []}
+    with mock.patch.object(main, 'get_counts', side_effect=[arrivals, recoveries]), \
+            mock.patch.object(main, '_recently_renewed', return_value=set()), \
+            mock.patch.object(main, '_recover') as recover_mock, \
+            mock.patch.object(Metrics, 'add_metric') as metric_mock:
+        main.handler({}, None)
+
+    recover_mock.assert_not_called()
+    metric_mock.assert_called_with(name='SilentApplications', unit=MetricUnit.Count, value=1)
+
+
+def test_recover(env_vars, capsys):  # pylint: disable=unused-argument
+    with mock.patch.object(main, '_client') as client_mock:
+        main._recover('admin')
+
+    client_mock.return_value.invoke.assert_called_once_with(
+        FunctionName='foo-renewer',
+        InvocationType='Event',
+        Payload=json.dumps({'application': 'admin', 'lambda_action': 'recover'}),
+    )
+    emitted = json.loads(capsys.readouterr().out)
+    assert emitted['Recoveries'] == [1.0]
+    assert emitted['application'] == 'admin'
@@ -0,0 +1,282 @@
+"""
+Lambda function to detect channels that have silently stopped delivering notifications
+
+The number of events for each application (as recorded by the endpoint's "ValidEvents" metric)
+during the same time of day on previous days is used as a baseline, since many applications are
+only active during working hours. If no events have arrived in the most recent window, and this
+silence is sufficiently unlikely given the baseline, the channel_renewer function is invoked to
+recover the channel for this application.
+
+Applications that remain silent after being recovered may simply be quiet, so each consecutive
+recovery (as recorded by this function's "Recoveries" metric) doubles the wait before the next.
+"""
+from datetime import datetime, timedelta, timezone
+import functools
+import json
+import logging
+import math
+import os
+
+from aws_lambda_powertools import Metrics, single_metric
+from aws_lambda_powertools.metrics import MetricUnit
+import boto3
+from botocore.config import Config
+
+logging.basicConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+metrics = Metrics()
+metrics.set_default_dimensions(environment=os.environ['PREFIX'])
+
+METRIC_NAME = 'ValidEvents'
+RECOVERY_METRIC_NAME = 'Recoveries'
+METRIC_PERIOD = 300  # seconds
+
+# Minimum number of events required in the baseline before any silence is considered anomalous
+MIN_BASELINE_EVENTS = 10
+
+# GetMetricData over the lookback period can take longer than other calls, so
+# allow a longer read timeout
+CLIENT_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=10,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+)
+
+
+def _record_retries(parsed: dict, **_):
+    """Record the number of retries needed for any AWS API call that succeeded"""
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        metrics.add_metric(name='ClientRetries', unit=MetricUnit.Count, value=retries)
+
+
+@functools.cache
+def _client(service: str):
+    """Return a client for this service, cached so connections are reused across invocations
+
+    Args:
+        service (str): The name of the AWS service
+    """
+    client = boto3.client(service, config=CLIENT_CONFIG)
+    client.meta.events.register('after-call', _record_retries)
+    return client
+
+
+def time_now() -> datetime:
+    """Return the current time in UTC"""
+    return datetime.now(tz=timezone.utc)
+
+
+def _query_id(app_name: str) -> str:
+    # GetMetricData query IDs must start with a lowercase letter and be alphanumeric
+    return f'app_{"".join(char if char.isalnum() else "_" for char in app_name)}'.lower()
+
+
+def get_counts(
+        applications: list[str],
+        start: datetime,
+        end: datetime,
+        metric_name: str = METRIC_NAME) -> dict:
+    """Fetch the sum of a metric per period for each application
+
+    Args:
+        applications (list[str]): The application names to fetch data for
+        start (datetime): The start of the lookback period
+        end (datetime): The end of the lookback period
+        metric_name (str): The name of the metric, which defaults to the number of events
+
+    Returns:
+        dict: Mapping of application name to a list of (timestamp, count) tuples
+    """
+    queries = {_query_id(app): app for app in applications}
+
+    paginator = _client('cloudwatch').get_paginator('get_metric_data')
+
+    arrivals = {app: [] for app in applications}
+    for page in paginator.paginate(
+        MetricDataQueries=[
+            {
+                'Id': query_id,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': os.environ['POWERTOOLS_METRICS_NAMESPACE'],
+                        'MetricName': metric_name,
+                        'Dimensions': [
+                            {'Name': 'environment', 'Value': os.environ['PREFIX']},
+                            {'Name': 'application', 'Value': app},
+                        ],
+                    },
+                    'Period': METRIC_PERIOD,
+                    'Stat': 'Sum',
+                },
+                'ReturnData': True,
+            } for query_id, app in queries.items()
+        ],
+        StartTime=start,
+        EndTime=end,
+    ):
+        for result in page['MetricDataResults']:
+            arrivals[queries[result['Id']]].extend(
+                zip(result['Timestamps'], result['Values'])
+            )
+
+    return arrivals
+
+
+def is_silent(
+        arrivals: list[tuple[datetime, float]],
+        window_start: datetime,
+        days: int,
+        threshold: float) -> bool:
+    """Determine if the lack of recent events for an application is anomalous
+
+    Event arrivals are treated as a Poisson process, where the expected number of events
+    in the window is the average for the same time of day over the previous days, and the
+    probability of observing zero events in the window is exp(-expected)
+
+    Args:
+        arrivals (list[tuple[datetime, float]]): Timestamps and counts of events received
+        window_start (datetime): The start of the recent window that is checked for silence
+        days (int): The number of previous days used as a baseline
+        threshold (float): The probability below which silence is considered anomalous
+    """
+    recent = sum(count for timestamp, count in arrivals if timestamp >= window_start)
+    if recent:
+        return False
+
+    now = time_now()
+    baseline = sum(
+        count for timestamp, count in arrivals
+        for day in range(1, days + 1)
+        if window_start - timedelta(days=day) <= timestamp < now - timedelta(days=day)
+    )
+    if baseline < MIN_BASELINE_EVENTS:
+        return False  # not enough history to establish a baseline
+
+    expected = baseline / days
+    probability = math.exp(-expected)
+
+    LOGGER.debug(
+        'Observed 0 events in window with %.2f expected (probability: %g)',
+        expected,
+        probability
+    )
+
+    return probability < threshold
+
+
+def in_backoff(
+        arrivals: list[tuple[datetime, float]],
+        recoveries: list[tuple[datetime, float]],
+        window: timedelta) -> bool:
+    """Determine if an application was recently recovered and should not be recovered again yet
+
+    An application with no events since it was last recovered may simply be quiet, so the
+    wait after each consecutive recovery doubles (2 windows, then 4, and so on)
+
+    Args:
+        arrivals (list[tuple[datetime, float]]): Timestamps and counts of events received
+        recoveries (list[tuple[datetime, float]]): Timestamps and counts of recoveries
+        window (timedelta): The length of the recent window that is checked for silence
+    """
+    last_event = max((timestamp for timestamp, count in arrivals if count), default=None)
+    attempts = sorted(
+        timestamp for timestamp, count in recoveries
+        if count and (last_event is None or timestamp > last_event)
+    )
+    if not attempts:
+        return False
+
+    return time_now() < attempts[-1] + window * 2 ** len(attempts)
+
+
+def _recently_renewed(window_start: datetime) -> set[str]:
+    """Return the applications whose step function was started within the window
+
+    Channels that were recently renewed (or recovered) may legitimately have no
+    events yet, so these are excluded to avoid repeatedly recovering them.
+
+    Args:
+        window_start (datetime): The start of the recent window that is checked for silence
+    """
+    response_iterator = _client('stepfunctions').get_paginator('list_executions').paginate(
+        stateMachineArn=os.environ['STATE_MACHINE_ARN'],
+        statusFilter='RUNNING',
+    )
+
+    # Execution names are formatted as <application>_<channel_id>
+    return {
+        execution['name'].rsplit('_', 1)[0]
+        for page in response_iterator
+        for execution in page['executions']
+        if execution['startDate'] >= window_start
+    }
+
+
+def _recover(app_name: str):
+    """Invoke the channel renewer function to recover the channel for this application
+
+    Args:
+        app_name (str): The application name for which the channel should be recovered
+    """
+    LOGGER.warning('Recovering channel for silent application: %s', app_name)
+
+    _client('lambda').invoke(
+        FunctionName=os.environ['CHANNEL_RENEWER_FUNCTION'],
+        InvocationType='Event',
+        Payload=json.dumps({'application': app_name, 'lambda_action': 'recover'}),
+    )
+
+    # Recorded per application, so consecutive recoveries can be backed off
+    with single_metric(
+        name=RECOVERY_METRIC_NAME,
+        unit=MetricUnit.Count,
+        value=1,
+        default_dimensions=metrics.default_dimensions,
+    ) as metric:
+        metric.add_dimension(name='application', value=app_name)
+
+
+@metrics.log_metrics
+def handler(event: dict, _):
+    """Lambda function handler invoked on a schedule to check for silent channels
+
+    Args:
+        event (dict): Scheduled event from EventBridge (unused)
+    """
+    LOGGER.debug('Received event: %s', event)
+
+    applications = json.loads(os.environ['APPLICATIONS'])
+    if not applications:
+        return
+
+    now = time_now()
+    window = timedelta(minutes=int(os.environ['WINDOW_MINUTES']))
+    window_start = now - window
+    days = int(os.environ['LOOKBACK_DAYS'])
+    lookback_start = window_start - timedelta(days=days)
+    threshold = float(os.environ['THRESHOLD'])
+
+    arrivals = get_counts(applications, lookback_start, now)
+    recoveries = get_counts(applications, lookback_start, now, RECOVERY_METRIC_NAME)
+    renewed = _recently_renewed(window_start)
+
+    silent = [
+        app for app in applications
+        if app not in renewed
+        and is_silent(arrivals[app], window_start, days, threshold)
+    ]
+
+    backoff = [app for app in silent if in_backoff(arrivals[app], recoveries[app], window)]
+    if backoff:
+        LOGGER.info('Silent applications were recently recovered; backing off: %s', backoff)
+
+    metrics.add_metric(name='SilentApplications', unit=MetricUnit.Count, value=len(silent))
+
+    for app_name in silent:
+        if app_name not in backoff:
+            _recover(app_name)
@@ -11,7 +11,6 @@ resource "aws_cloudwatch_log_group" "deduplication_lambda" {
 }
 
 data "aws_iam_policy_document" "lambda_assume_role" {
-  count = var.deduplication.enabled == true ? 1 : 0
   statement {
     effect  = "Allow"
     actions = ["sts:AssumeRole"]
@@ -26,7 +25,7 @@ data "aws_iam_policy_document" "lambda_assume_role" {
 resource "aws_iam_role" "deduplication" {
   count              = var.deduplication.enabled == true ? 1 : 0
   name               = "${local.function_name}-role"
-  assume_role_policy = data.aws_iam_policy_document.lambda_assume_role[0].json
+  assume_role_policy = data.aws_iam_policy_document.lambda_assume_role.json
 }
 
 resource "aws_lambda_function" "deduplication" {
@@ -55,8 +54,14 @@ resource "aws_lambda_function" "deduplication" {
       PREFIX                       = var.prefix
       LOG_LEVEL                    = var.deduplication.lambda.log_level
       POWERTOOLS_METRICS_NAMESPACE = local.metrics_namespace
+      DEBUG_SAMPLE_RATE            = var.deduplication.lambda.debug_sample_rate
+      TRIM_FIELDS                  = join(",", var.deduplication.trim_fields)
     }
   }
+
+  logging_config {
+    log_format = var.deduplication.lambda.log_format
+  }
 }
 
 resource "aws_lambda_alias" "deduplication" {
@@ -72,6 +72,8 @@ resource "aws_kinesis_firehose_delivery_stream" "s3" {
             parameter_name  = "BufferIntervalInSeconds"
             parameter_value = 300 # seconds, default = 60
           }
+          # This is the maximum buffer size for Lambda processors. The Lambda function omits
+          # the payload of dropped records, so its response is smaller than this input
           parameters {
             parameter_name  = "BufferSizeInMBs"
             parameter_value = 3
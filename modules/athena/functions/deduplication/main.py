@@ -5,6 +5,7 @@ import base64
 import json
 import logging
 import os
+import zlib
 
 from aws_lambda_powertools import Metrics
 from aws_lambda_powertools.metrics import MetricUnit
@@ -20,15 +21,112 @@ LOGGER.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 RESULT_OK = 'Ok'
 RESULT_DROPPED = 'Dropped'
 
+# Fraction of records (0.0 to 1.0) for which debug logging should be enabled
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_SAMPLE_RATE', 0))
+
+# Comma separated list of (optionally nested) fields to remove from records
+# eg: "etag,id.customerId"
+TRIM_FIELDS = [
+    tuple(field.strip().split('.')) for field in os.environ.get('TRIM_FIELDS', '').split(',')
+    if field.strip()
+]
+
+# Fields extracted by the Firehose for dynamic partitioning, which must never be removed
+PARTITION_FIELDS = {('id', 'time'), ('id', 'applicationName')}
+
+
+def _validate_trim_fields(fields: list[tuple[str, ...]]):
+    """Ensure none of the fields to trim would remove a field used for partitioning
+
+    Args:
+        fields (list[tuple[str, ...]]): Paths of the fields to remove
+    """
+    for path in fields:
+        for partition_field in PARTITION_FIELDS:
+            # Removing a parent (eg: "id") would also remove the partition field
+            if partition_field[:len(path)] == path:
+                raise ValueError(
+                    f'Cannot trim field "{".".join(path)}", which is required for partitioning'
+                )
+
+
+_validate_trim_fields(TRIM_FIELDS)
+
+
+def is_sampled(key: str | None) -> bool:
+    """Deterministically decide if debug logging should be enabled for this record
+
+    The key matches the one used by the endpoint function, so the same events
+    are sampled in both functions
+
+    Args:
+        key (str): The unique key for this record
+    """
+    if not key or not DEBUG_SAMPLE_RATE:
+        return False
+
+    return zlib.crc32(key.encode()) % 10000 < DEBUG_SAMPLE_RATE * 10000
+
+
+def sampled_level(key: str | None) -> int | None:
+    """Return the level at which to log debug details for this record, if they should be logged
+
+    Details for sampled records are logged at INFO, so they are emitted at the default
+    log level without changing the level of the (shared) logger
+
+    Args:
+        key (str): The unique key for this record
+    """
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        return logging.DEBUG
+
+    return logging.INFO if is_sampled(key) else None
+
+
+def _trim(data: dict, fields: list[tuple[str, ...]]) -> bool:
+    """Remove the specified fields from the record, if they exist
+
+    Args:
+        data (dict): The decoded record
+        fields (list[tuple[str, ...]]): Paths of the fields to remove
+
+    Returns:
+        bool: True if any field was removed
+    """
+    trimmed = False
+    for path in fields:
+        parent = data
+        for key in path[:-1]:
+            parent = parent.get(key)
+            if not isinstance(parent, dict):
+                break
+        else:
+            # Check for the key explicitly, since the value being removed may be null
+            if path[-1] in parent:
+                parent.pop(path[-1])
+                trimmed = True
+
+    return trimmed
+
 
 @metrics.log_metrics
 def handler(event: dict, _) -> dict:
     """Analyze a batch of records and mark any duplicates as Dropped"""
-    LOGGER.debug('Received %d records in event: %s', len(event['records']), event)
+    LOGGER.debug('Received %d records in event', len(event['records']))
 
     records, dropped = _dedupe(event['records'])
 
     metrics.add_metric(name='DroppedDuplicates', unit=MetricUnit.Count, value=dropped)
+    metrics.add_metric(
+        name='TransformBytesIn',
+        unit=MetricUnit.Bytes,
+        value=sum(len(record['data']) for record in event['records'])
+    )
+    metrics.add_metric(
+        name='TransformBytesOut',
+        unit=MetricUnit.Bytes,
+        value=sum(len(record['data']) for record in records)
+    )
 
     return {'records': records}
 
@@ -36,14 +134,17 @@ def handler(event: dict, _) -> dict:
 def _dedupe(records: list[dict]) -> tuple[list[dict], int]:
     """Deduplicate a list of records based on a unique key
 
+    The payload of dropped records is not returned, to keep the size of the response
+    to Firehose as small as possible
+
     Args:
         records (list[dict]): List of records to deduplicate
     """
     ids = set()
     results = []
     dropped = 0
+
     for record in records:
-        LOGGER.debug('Processing record with ID: %s', record['recordId'])
         payload = base64.b64decode(record['data'])
 
         output_record = {
@@ -61,8 +162,24 @@ def _dedupe(records: list[dict]) -> tuple[list[dict], int]:
                 ids.add(uniq_key)
             else:
                 output_record['result'] = RESULT_DROPPED
+                output_record['data'] = ''
                 dropped += 1
+
+            level = sampled_level(uniq_key)
+            if level:
+                LOGGER.log(
+                    level,
+                    'Processed record with ID %s: %s',
+                    record['recordId'],
+                    output_record['result'],
+                    extra={'event_key': uniq_key},
+                )
         finally:
             results.append(output_record)
 
+        if output_record['result'] == RESULT_OK and TRIM_FIELDS and _trim(data, TRIM_FIELDS):
+            output_record['data'] = base64.b64encode(
+                json.dumps(data, separators=(',', ':')).encode()
+            ).decode()
+
     return results, dropped
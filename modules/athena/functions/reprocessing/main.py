@@ -0,0 +1,319 @@
+"""
+Lambda function used to reprocess records that Firehose could not deliver, such as those
+that failed metadata extraction or Parquet conversion, by repairing and re-ingesting them
+Reference: https://docs.aws.amazon.com/firehose/latest/dev/basic-deliver.html#retry
+"""
+import base64
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import functools
+import json
+import logging
+import os
+import time
+
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+import boto3
+from botocore.config import Config
+
+logging.basicConfig()
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+metrics = Metrics()
+metrics.set_default_dimensions(environment=os.environ['PREFIX'])
+
+# PutRecordBatch limits
+# Reference: https://docs.aws.amazon.com/firehose/latest/APIReference/API_PutRecordBatch.html
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+MAX_PUT_ATTEMPTS = 5
+MAX_WORKERS = 8
+
+# Size the connection pool to match the number of concurrent workers
+CLIENT_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=30,
+    tcp_keepalive=True,
+    max_pool_connections=MAX_WORKERS,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+)
+
+
+# Calls are made from worker threads and Metrics is not thread-safe, so retries are
+# collected here (list appends are atomic) and added as a metric by the handler
+_RETRIES = []
+
+
+def _record_retries(parsed: dict, **_):
+    """Record the number of retries needed for any AWS API call that succeeded"""
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        _RETRIES.append(retries)
+
+
+@functools.cache
+def _client(service: str):
+    """Return a client for this service, cached so connections are reused across invocations
+
+    Args:
+        service (str): The name of the AWS service
+    """
+    client = boto3.client(service, config=CLIENT_CONFIG)
+    client.meta.events.register('after-call', _record_retries)
+    return client
+
+
+def _repair_application(body: dict) -> str:
+    """Ensure the body contains an application name, using the same fallback as the endpoint
+
+    Args:
+        body (dict): The decoded event
+    """
+    body_id = body.setdefault('id', {})
+    if not isinstance(body_id, dict):
+        raise ValueError(f'id is not an object: {body_id!r}')
+
+    if body_id.get('applicationName'):
+        return body_id['applicationName']
+
+    # The resource URI header used by the endpoint is not available at this stage,
+    # so the endpoint's final fallback value is used
+    LOGGER.warning('id.applicationName not found in body; using "unknown"')
+    body_id['applicationName'] = 'unknown'
+    return body_id['applicationName']
+
+
+def _repair_time(body: dict):
+    """Normalize the id.time value to the format expected by the Firehose metadata extraction
+
+    Dates from gsuite logs are in the format: 2022-07-25T00:05:53.167Z
+
+    Args:
+        body (dict): The decoded event
+    """
+    try:
+        event_time = body['id']['time']
+    except KeyError:
+        LOGGER.error('id.time not found in body')
+        return
+
+    if not isinstance(event_time, str):
+        raise ValueError(f'id.time is not a string: {event_time!r}')
+
+    # Strip the trailing Z for UTC that python cannot handle well
+    value = event_time[:-1] if event_time.endswith('Z') else event_time
+    try:
+        parsed_time = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        LOGGER.error('id.time could not be parsed: %s', event_time)
+        return
+
+    if parsed_time.tzinfo is None:
+        parsed_time = parsed_time.replace(tzinfo=timezone.utc)
+    parsed_time = parsed_time.astimezone(timezone.utc)
+
+    body['id']['time'] = (
+        f'{parsed_time.strftime("%Y-%m-%dT%H:%M:%S")}.{parsed_time.microsecond // 1000:03d}Z'
+    )
+
+
+def repair_record(raw_data: str) -> bytes:
+    """Decode and repair the original payload of a failed record
+
+    Args:
+        raw_data (str): The base64 encoded payload from the "rawData" field of the failure
+    """
+    body = json.loads(base64.b64decode(raw_data))
+    # Records that failed extraction may be valid JSON without the expected structure
+    if not isinstance(body, dict):
+        raise ValueError(f'Record is not an object: {body!r}')
+
+    _repair_application(body)
+    _repair_time(body)
+
+    return json.dumps(body, separators=(',', ':')).encode()
+
+
+def _read_failures(key: str, counts: collections.Counter):
+    """Read and repair the failed records in a single S3 object, one line at a time
+
+    Each line of the object is a JSON document that wraps the original payload
+
+    Args:
+        key (str): The S3 key of the object containing failed records
+        counts (collections.Counter): Counter to which unrepairable records are added
+
+    Yields:
+        bytes: Each record that was repaired
+    """
+    response = _client('s3').get_object(Bucket=os.environ['S3_BUCKET'], Key=key)
+
+    for line in response['Body'].iter_lines():
+        if not line:
+            continue
+        try:
+            yield repair_record(json.loads(line)['rawData'])
+        except (KeyError, TypeError, ValueError) as err:
+            LOGGER.error('Record in %s could not be repaired: %s', key, err)
+            counts['unrepairable'] += 1
+
+
+def _batches(records):
+    """Yield batches of records that are within the PutRecordBatch limits
+
+    Args:
+        records (Iterable[bytes]): The records to batch
+    """
+    batch = []
+    batch_size = 0
+    for record in records:
+        if len(batch) == MAX_BATCH_RECORDS or batch_size + len(record) > MAX_BATCH_BYTES:
+            yield batch
+            batch = []
+            batch_size = 0
+
+        batch.append(record)
+        batch_size += len(record)
+
+    if batch:
+        yield batch
+
+
+def _put_records(records: list[bytes]) -> int:
+    """Send a batch of records to Firehose, retrying any that partially fail
+
+    Args:
+        records (list[bytes]): The batch of records to send
+
+    Returns:
+        int: The number of records that could not be sent after all attempts
+    """
+    for attempt in range(MAX_PUT_ATTEMPTS):
+        if attempt:
+            time.sleep(min(2 ** attempt * 0.1, 2))  # backoff before retrying
+
+        response = _client('firehose').put_record_batch(
+            DeliveryStreamName=os.environ['DELIVERY_STREAM_NAME'],
+            Records=[{'Data': record} for record in records],
+        )
+
+        if not response['FailedPutCount']:
+            return 0
+
+        # Responses are ordered to match the request, so retry only failed entries
+        records = [
+            record for record, result in zip(records, response['RequestResponses'])
+            if 'ErrorCode' in result
+        ]
+        LOGGER.warning('Failed to put %d records on attempt %d', len(records), attempt + 1)
+
+    return len(records)
+
+
+def _reprocess_object(key: str) -> collections.Counter:
+    """Repair and re-ingest the failed records in a single S3 object
+
+    Records are streamed from the object and sent as each batch fills, so only
+    one batch per object is held in memory at a time.
+
+    Args:
+        key (str): The S3 key of the object containing failed records
+
+    Returns:
+        collections.Counter: The number of records that were reprocessed, failed, or unrepairable
+    """
+    counts = collections.Counter()
+    for batch in _batches(_read_failures(key, counts)):
+        failed = _put_records(batch)
+        counts['reprocessed'] += len(batch) - failed
+        counts['failed'] += failed
+
+    LOGGER.debug('Reprocessed records from %s: %s', key, dict(counts))
+
+    return counts
+
+
+@metrics.log_metrics
+def handler(event: dict, _) -> dict:
+    """Reprocess failed records found under the failures prefix in S3
+
+    Example event (all keys are optional):
+        {
+            "prefix": "processing-failed/2022/07/25/",
+            "delete": true
+        }
+
+    The "prefix" value is appended to the failures prefix of the Firehose, and
+    the "delete" value indicates if S3 objects should be removed once every record
+    in them was successfully repaired and reprocessed.
+    """
+    LOGGER.info('Received event: %s', event)
+
+    prefix = f"{os.environ['FAILURES_PREFIX']}{event.get('prefix', '')}"
+
+    keys = [
+        key for key in _client('s3').get_paginator('list_objects_v2').paginate(
+            Bucket=os.environ['S3_BUCKET'],
+            Prefix=prefix,
+        ).search('Contents[].Key')
+        if key  # an empty listing yields None
+    ]
+
+    LOGGER.info('Found %d objects to reprocess under prefix %s', len(keys), prefix)
+
+    totals = collections.Counter()
+    completed = []
+
+    # Reprocessing is IO bound, so handle objects concurrently. Counts are returned to
+    # this thread and added to metrics here, since Metrics is not thread-safe.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for key, counts in zip(keys, executor.map(_reprocess_object, keys)):
+            totals.update(counts)
+            # Only objects whose records were all repaired and sent are safe to delete
+            if counts['failed'] or counts['unrepairable']:
+                continue
+
+            completed.append(key)
+            if event.get('delete'):
+                # Delete each object as it completes, so its records are not sent
+                # again by a later run if this one does not finish
+                LOGGER.debug('Deleting reprocessed object %s', key)
+                _client('s3').delete_object(Bucket=os.environ['S3_BUCKET'], Key=key)
+
+    metrics.add_metric(
+        name='ReprocessedRecords',
+        unit=MetricUnit.Count,
+        value=totals['reprocessed']
+    )
+    metrics.add_metric(
+        name='ReprocessingFailedRecords',
+        unit=MetricUnit.Count,
+        value=totals['failed']
+    )
+    metrics.add_metric(
+        name='UnrepairableRecords',
+        unit=MetricUnit.Count,
+        value=totals['unrepairable']
+    )
+
+    retries = sum(_RETRIES)
+    _RETRIES.clear()
+    if retries:
+        metrics.add_metric(name='ClientRetries', unit=MetricUnit.Count, value=retries)
+
+    result = {
+        'objects': len(keys),
+        'completed_objects': len(completed),
+        'reprocessed_records': totals['reprocessed'],
+        'failed_records': totals['failed'],
+        'unrepairable_records': totals['unrepairable'],
+    }
+
+    LOGGER.info('Reprocessing results: %s', result)
+
+    return result
@@ -1,6 +1,7 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring
 import base64
 import json
+import logging
 import os
 from unittest import mock
 
@@ -12,6 +13,7 @@ ENV = {
 }
 
 with mock.patch.dict(os.environ, ENV):
+    from deduplication import main
     from deduplication.main import _dedupe
 
 
@@ -74,6 +76,78 @@ def test_dedupe(t_records, t_results):
     result, duplicates = _dedupe(records)
     results = [res['result'] for res in result]
 
-    assert all(res['data'] for res in result)
+    assert all(res['data'] for res in result if res['result'] == 'Ok')
+    assert not any(res['data'] for res in result if res['result'] == 'Dropped')
     assert duplicates == expected_duplicates
     assert results == expected_results
+
+
+@pytest.mark.parametrize('rate, logged', [(0, False), (1, True)])
+def test_dedupe_sampled_logging(rate, logged, caplog):
+    data = {'id': {'time': '2022-07-27T06:30:00.000Z', 'uniqueQualifier': '1234567890'}}
+    records = [{'data': base64.b64encode(json.dumps(data).encode()), 'recordId': 'foobar'}]
+
+    main.LOGGER.setLevel(logging.INFO)
+    with mock.patch.object(main, 'DEBUG_SAMPLE_RATE', rate), caplog.at_level(logging.INFO):
+        _dedupe(records)
+
+    assert ('Processed record with ID foobar: Ok' in caplog.text) == logged
+
+
+@pytest.mark.parametrize('fields, expected, trimmed', [
+    ([('etag',)], {'id': {'time': 't', 'customerId': 'c'}}, True),
+    ([('id', 'customerId')], {'id': {'time': 't'}, 'etag': 'e'}, True),
+    (
+        [('missing',), ('id', 'missing'), ('etag', 'nested')],
+        {'id': {'time': 't', 'customerId': 'c'}, 'etag': 'e'},
+        False,
+    ),
+])
+def test_trim(fields, expected, trimmed):
+    data = {'id': {'time': 't', 'customerId': 'c'}, 'etag': 'e'}
+    assert main._trim(data, fields) == trimmed  # pylint: disable=protected-access
+    assert data == expected
+
+
+def test_trim_null_value():
+    data = {'id': {'time': 't'}, 'etag': None}
+    assert main._trim(data, [('etag',)])  # pylint: disable=protected-access
+    assert data == {'id': {'time': 't'}}
+
+
+@pytest.mark.parametrize('fields, valid', [
+    ([('etag',), ('id', 'customerId')], True),
+    ([('id', 'time')], False),
+    ([('id', 'applicationName')], False),
+    ([('id',)], False),
+])
+def test_validate_trim_fields(fields, valid):
+    if valid:
+        main._validate_trim_fields(fields)  # pylint: disable=protected-access
+    else:
+        with pytest.raises(ValueError):
+            main._validate_trim_fields(fields)  # pylint: disable=protected-access
+
+
+def test_dedupe_trim_fields():
+    data = {
+        'id': {'time': '2022-07-27T06:30:00.000Z', 'uniqueQualifier': '1234567890'},
+        'etag': 'foo',
+    }
+    records = [{'data': base64.b64encode(json.dumps(data).encode()), 'recordId': 'foobar'}] * 2
+
+    with mock.patch.object(main, 'TRIM_FIELDS', [('etag',)]):
+        result, _ = _dedupe(records)
+
+    assert json.loads(base64.b64decode(result[0]['data'])) == {'id': data['id']}
+    assert result[1] == {'recordId': 'foobar', 'result': 'Dropped', 'data': ''}
+
+
+def test_dedupe_trim_fields_invalid_record():
+    data = base64.b64encode(json.dumps('not an object').encode())
+    records = [{'data': data, 'recordId': 'foobar'}]
+
+    # The original error is raised, rather than one from trimming the record
+    with mock.patch.object(main, 'TRIM_FIELDS', [('id', 'customerId')]), \
+            pytest.raises(TypeError, match='string indices'):
+        _dedupe(records)
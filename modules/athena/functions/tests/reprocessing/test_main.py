@@ -0,0 +1,184 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,line-too-long,protected-access
+import base64
+import json
+import os
+from unittest import mock
+
+import pytest
+
+ENV = {
+    'PREFIX': 'foo',
+    'POWERTOOLS_METRICS_NAMESPACE': 'gsuite-logs-channeler',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'DELIVERY_STREAM_NAME': 'foo-stream',
+    'S3_BUCKET': 'bucket',
+    'FAILURES_PREFIX': 'processing-failed/',
+}
+
+with mock.patch.dict(os.environ, ENV):
+    from reprocessing import main
+
+
+@pytest.fixture(name='env_vars')
+def fixture_env_vars():
+    with mock.patch.dict(os.environ, ENV):
+        yield
+
+
+@pytest.mark.parametrize('body, expected_id', [
+    (
+        {'id': {'time': '2022-07-27T06:30:00.123Z', 'applicationName': 'admin'}},
+        {'time': '2022-07-27T06:30:00.123Z', 'applicationName': 'admin'},
+    ),
+    (
+        {'id': {'time': '2022-07-27T06:30:00Z', 'applicationName': None}},
+        {'time': '2022-07-27T06:30:00.000Z', 'applicationName': 'unknown'},
+    ),
+    (
+        {'id': {'time': '2022-07-27T06:30:00.123456Z'}},
+        {'time': '2022-07-27T06:30:00.123Z', 'applicationName': 'unknown'},
+    ),
+    (
+        {'id': {'time': '2022-07-27T08:30:00.123+02:00', 'applicationName': 'drive'}},
+        {'time': '2022-07-27T06:30:00.123Z', 'applicationName': 'drive'},
+    ),
+    (
+        {'id': {'time': 'bad time', 'applicationName': 'drive'}},
+        {'time': 'bad time', 'applicationName': 'drive'},
+    ),
+])
+def test_repair_record(body, expected_id):
+    result = main.repair_record(base64.b64encode(json.dumps(body).encode()))
+    assert json.loads(result)['id'] == expected_id
+
+
+def test_batches():
+    records = [b'x' * 10] * 1001
+    assert [len(batch) for batch in main._batches(records)] == [500, 500, 1]
+
+
+def test_batches_size():
+    records = [b'x' * (1024 * 1024)] * 5
+    assert [len(batch) for batch in main._batches(records)] == [4, 1]
+
+
+def test_put_records_retry(env_vars):  # pylint: disable=unused-argument
+    with mock.patch.object(main._client('firehose'), 'put_record_batch') as put_mock, \
+            mock.patch.object(main.time, 'sleep'):
+        put_mock.side_effect = [
+            {
+                'FailedPutCount': 1,
+                'RequestResponses': [
+                    {'RecordId': '1'},
+                    {'ErrorCode': 'ServiceUnavailableException'},
+                ],
+            },
+            {
+                'FailedPutCount': 0,
+                'RequestResponses': [{'RecordId': '2'}],
+            },
+        ]
+        assert main._put_records([b'a', b'b']) == 0
+        put_mock.assert_called_with(DeliveryStreamName='foo-stream', Records=[{'Data': b'b'}])
+
+
+def test_put_records_exhausted(env_vars):  # pylint: disable=unused-argument
+    with mock.patch.object(main._client('firehose'), 'put_record_batch') as put_mock, \
+            mock.patch.object(main.time, 'sleep'):
+        put_mock.return_value = {
+            'FailedPutCount': 1,
+            'RequestResponses': [{'ErrorCode': 'ServiceUnavailableException'}],
+        }
+        assert main._put_records([b'a']) == 1
+        assert put_mock.call_count == main.MAX_PUT_ATTEMPTS
+
+
+def _failure(body: dict) -> bytes:
+    return json.dumps({'rawData': base64.b64encode(json.dumps(body).encode()).decode()}).encode()
+
+
+@pytest.mark.parametrize('raw_data', [
+    b'[1, 2]',
+    b'"str"',
+    b'null',
+    b'{"id": "x"}',
+    b'{"id": {"time": 123}}',
+])
+def test_reprocess_object_unexpected_shape(raw_data, env_vars):  # pylint: disable=unused-argument
+    lines = [json.dumps({'rawData': base64.b64encode(raw_data).decode()}).encode()]
+    with mock.patch.object(main._client('s3'), 'get_object') as get_mock, \
+            mock.patch.object(main, '_put_records', return_value=0) as put_mock:
+        get_mock.return_value = {'Body': mock.Mock(iter_lines=mock.Mock(return_value=iter(lines)))}
+        counts = main._reprocess_object('processing-failed/foo')
+
+    assert counts == {'unrepairable': 1}
+    put_mock.assert_not_called()
+
+
+def test_reprocess_object(env_vars):  # pylint: disable=unused-argument
+    lines = [
+        _failure({'id': {'time': '2022-07-27T06:30:00Z', 'applicationName': 'admin'}}),
+        b'',
+        b'not json',
+        b'{"errorCode": "missing rawData"}',
+        _failure({'id': {'time': '2022-07-27T06:31:00Z', 'applicationName': 'admin'}}),
+    ]
+    with mock.patch.object(main._client('s3'), 'get_object') as get_mock, \
+            mock.patch.object(main, '_put_records', return_value=0) as put_mock:
+        get_mock.return_value = {'Body': mock.Mock(iter_lines=mock.Mock(return_value=iter(lines)))}
+        counts = main._reprocess_object('processing-failed/foo')
+
+    assert counts == {'reprocessed': 2, 'failed': 0, 'unrepairable': 2}
+    assert len(put_mock.call_args.args[0]) == 2
+
+
+def test_handler(env_vars):  # pylint: disable=unused-argument
+    keys = ['processing-failed/a', 'processing-failed/b', 'processing-failed/c']
+    counts = {
+        'processing-failed/a': main.collections.Counter(reprocessed=2),
+        'processing-failed/b': main.collections.Counter(reprocessed=1, unrepairable=1),
+        'processing-failed/c': main.collections.Counter(reprocessed=1, failed=1),
+    }
+    with mock.patch.object(main._client('s3'), 'get_paginator') as paginator_mock, \
+            mock.patch.object(main._client('s3'), 'delete_object') as delete_mock, \
+            mock.patch.object(main, '_reprocess_object', side_effect=counts.get):
+        paginator_mock.return_value.paginate.return_value.search.return_value = keys
+        result = main.handler({'delete': True}, None)
+
+    paginator_mock.return_value.paginate.assert_called_with(Bucket='bucket', Prefix='processing-failed/')
+    delete_mock.assert_called_once_with(Bucket='bucket', Key='processing-failed/a')
+    assert result == {
+        'objects': 3,
+        'completed_objects': 1,
+        'reprocessed_records': 4,
+        'failed_records': 1,
+        'unrepairable_records': 1,
+    }
+
+
+def test_handler_no_delete(env_vars):  # pylint: disable=unused-argument
+    with mock.patch.object(main._client('s3'), 'get_paginator') as paginator_mock, \
+            mock.patch.object(main._client('s3'), 'delete_object') as delete_mock, \
+            mock.patch.object(main, '_reprocess_object', return_value=main.collections.Counter(reprocessed=1)):
+        paginator_mock.return_value.paginate.return_value.search.return_value = [None]
+        result = main.handler({'prefix': '2022/07/25/'}, None)
+
+    paginator_mock.return_value.paginate.assert_called_with(Bucket='bucket', Prefix='processing-failed/2022/07/25/')
+    delete_mock.assert_not_called()
+    assert result['objects'] == 0
+
+
+def test_handler_retries(env_vars):  # pylint: disable=unused-argument
+    def _reprocess(_):
+        # retries recorded from worker threads are only added as a metric by the handler
+        main._record_retries({'ResponseMetadata': {'RetryAttempts': 2}})
+        return main.collections.Counter(reprocessed=1)
+
+    with mock.patch.object(main._client('s3'), 'get_paginator') as paginator_mock, \
+            mock.patch.object(main, '_reprocess_object', side_effect=_reprocess), \
+            mock.patch.object(main.metrics, 'add_metric') as metric_mock:
+        paginator_mock.return_value.paginate.return_value.search.return_value = ['a', 'b']
+        main.handler({}, None)
+
+    metric_mock.assert_any_call(name='ClientRetries', unit=main.MetricUnit.Count, value=4)
+    assert not main._RETRIES
@@ -0,0 +1,118 @@
+locals {
+  reprocessing_function_name = "${var.prefix}-gsuite-admin-reports-${var.table_name}-reprocessing"
+  failures_prefix            = "${local.table_location}_failures/"
+}
+
+resource "aws_cloudwatch_log_group" "reprocessing_lambda" {
+  count             = var.reprocessing.enabled == true ? 1 : 0
+  name              = "/aws/lambda/${local.reprocessing_function_name}"
+  retention_in_days = var.reprocessing.lambda.log_retention_days
+}
+
+resource "aws_iam_role" "reprocessing" {
+  count              = var.reprocessing.enabled == true ? 1 : 0
+  name               = "${local.reprocessing_function_name}-role"
+  assume_role_policy = data.aws_iam_policy_document.lambda_assume_role.json
+}
+
+resource "aws_lambda_function" "reprocessing" {
+  count            = var.reprocessing.enabled == true ? 1 : 0
+  function_name    = local.reprocessing_function_name
+  handler          = "main.handler"
+  memory_size      = var.reprocessing.lambda.memory
+  publish          = true
+  role             = aws_iam_role.reprocessing[0].arn
+  runtime          = "python3.12"
+  timeout          = var.reprocessing.lambda.timeout
+  filename         = data.archive_file.reprocessing[0].output_path
+  source_code_hash = data.archive_file.reprocessing[0].output_base64sha256
+
+  layers = [
+    coalesce(
+      var.reprocessing.lambda.aws_lambda_powertools_layer_arn,
+      # Default to public Lambda layer corresponding to semantic version v2.41.0 of aws-lambda-powertools
+      # Reference: https://docs.powertools.aws.dev/lambda/python/2.41.0/#lambda-layer
+      "arn:aws:lambda:${local.region}:017000801446:layer:AWSLambdaPowertoolsPythonV2:76"
+    )
+  ]
+
+  environment {
+    variables = {
+      PREFIX                       = var.prefix
+      LOG_LEVEL                    = var.reprocessing.lambda.log_level
+      POWERTOOLS_METRICS_NAMESPACE = local.metrics_namespace
+      S3_BUCKET                    = var.s3_bucket_name
+      FAILURES_PREFIX              = local.failures_prefix
+      DELIVERY_STREAM_NAME         = aws_kinesis_firehose_delivery_stream.s3.name
+    }
+  }
+}
+
+data "archive_file" "reprocessing" {
+  count       = var.reprocessing.enabled == true ? 1 : 0
+  type        = "zip"
+  source_dir  = "${path.module}/functions/reprocessing"
+  output_path = "${path.module}/builds/reprocessing.zip"
+}
+
+data "aws_iam_policy_document" "reprocessing" {
+  count = var.reprocessing.enabled == true ? 1 : 0
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:ListBucket"]
+    resources = [local.s3_bucket_arn]
+
+    condition {
+      test     = "StringLike"
+      variable = "s3:prefix"
+      values   = ["${local.failures_prefix}*"]
+    }
+  }
+  statement {
+    effect = "Allow"
+    actions = [
+      "s3:GetObject",
+      "s3:DeleteObject",
+    ]
+    resources = ["${local.s3_bucket_arn}/${local.failures_prefix}*"]
+  }
+  statement {
+    effect    = "Allow"
+    actions   = ["firehose:PutRecordBatch"]
+    resources = [aws_kinesis_firehose_delivery_stream.s3.arn]
+  }
+  statement {
+    effect = "Allow"
+    actions = [
+      "logs:CreateLogGroup",
+      "logs:CreateLogStream",
+      "logs:PutLogEvents",
+    ]
+    resources = [
+      "${aws_cloudwatch_log_group.reprocessing_lambda[0].arn}:*",
+      "${aws_cloudwatch_log_group.reprocessing_lambda[0].arn}:*:*",
+    ]
+  }
+
+  dynamic "statement" {
+    for_each = var.s3_sse_kms_arn != "" ? [1] : []
+
+    content {
+      actions   = ["kms:Decrypt"]
+      resources = [var.s3_sse_kms_arn]
+
+      condition {
+        test     = "StringEquals"
+        variable = "kms:ViaService"
+        values   = ["s3.${local.region}.amazonaws.com"]
+      }
+    }
+  }
+}
+
+resource "aws_iam_role_policy" "reprocessing" {
+  count  = var.reprocessing.enabled == true ? 1 : 0
+  name   = "DefaultPolicy"
+  role   = aws_iam_role.reprocessing[0].name
+  policy = data.aws_iam_policy_document.reprocessing[0].json
+}
@@ -91,27 +91,67 @@ variable "firehose_cloudwatch_logs_retention_in_days" {
 
 variable "deduplication" {
   type = object({
-    enabled = optional(bool, false)
+    enabled     = optional(bool, false)
+    trim_fields = optional(list(string), [])
     lambda = optional(object({
       timeout                         = optional(number, 300)
       memory                          = optional(number, 128)
       log_level                       = optional(string, "INFO")
+      log_format                      = optional(string, "Text")
+      debug_sample_rate               = optional(number, 0)
       log_retention_days              = optional(number, 30)
       aws_lambda_powertools_layer_arn = optional(string, null)
     }), {})
   })
   description = <<EOT
 deduplication = {
-  enabled = "Boolean to indicate if logs should be deduplicated using a best-effort strategy with Kinesis Data Transformation and an intermediary Lambda function"
+  enabled     = "Boolean to indicate if logs should be deduplicated using a best-effort strategy with Kinesis Data Transformation and an intermediary Lambda function"
+  trim_fields = "List of fields to remove from logs before they are stored, using dot notation for nested fields (eg: etag, id.customerId)"
   lambda = {
     timeout                         = "Timeout for Lambda function"
     memory                          = "Memory, in MB, for Lambda function"
     log_level                       = "String version of the Python logging levels (eg: INFO, DEBUG, CRITICAL) "
+    log_format                      = "Format of the Lambda function's CloudWatch Logs (JSON or Text)"
+    debug_sample_rate               = "Fraction of records (0.0 to 1.0) for which debug logging is enabled, regardless of log_level"
     log_retention_days              = "Number of days for which this Lambda function's CloudWatch Logs should be retained"
     aws_lambda_powertools_layer_arn = "ARN of python3.12 compatible Lambda Layer for aws-lambda-powertools
   }
 }
 EOT
   default     = {}
+
+  validation {
+    condition = alltrue([
+      for field in var.deduplication.trim_fields :
+      !contains(["id", "id.time", "id.applicationName"], trimspace(field))
+    ])
+    error_message = "deduplication.trim_fields cannot include id.time or id.applicationName (or their parent), which are required for partitioning."
+  }
 }
 
+
+variable "reprocessing" {
+  type = object({
+    enabled = optional(bool, false)
+    lambda = optional(object({
+      timeout                         = optional(number, 900)
+      memory                          = optional(number, 512)
+      log_level                       = optional(string, "INFO")
+      log_retention_days              = optional(number, 30)
+      aws_lambda_powertools_layer_arn = optional(string, null)
+    }), {})
+  })
+  description = <<EOT
+reprocessing = {
+  enabled = "Boolean to indicate if a Lambda function should be created to repair and re-ingest records that Firehose failed to process"
+  lambda = {
+    timeout                         = "Timeout for Lambda function"
+    memory                          = "Memory, in MB, for Lambda function"
+    log_level                       = "String version of the Python logging levels (eg: INFO, DEBUG, CRITICAL) "
+    log_retention_days              = "Number of days for which this Lambda function's CloudWatch Logs should be retained"
+    aws_lambda_powertools_layer_arn = "ARN of python3.12 compatible Lambda Layer for aws-lambda-powertools
+  }
+}
+EOT
+  default     = {}
+}
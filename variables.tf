@@ -49,6 +49,9 @@ variable "lambda_settings" {
       timeout                         = optional(number, 30)
       memory                          = optional(number, 128)
       log_level                       = optional(string, "INFO")
+      log_format                      = optional(string, "Text")
+      debug_sample_rate               = optional(number, 0)
+      overlap_window_sec              = optional(number, 60)
       log_retention_days              = optional(number, 30)
       aws_lambda_powertools_layer_arn = optional(string, null)
     }), {})
@@ -66,6 +69,9 @@ lambda_settings = {
     timeout                         = "Timeout for Lambda function"
     memory                          = "Memory, in MB, for Lambda function"
     log_level                       = "String version of the Python logging levels (eg: INFO, DEBUG, CRITICAL) "
+    log_format                      = "Format of the Lambda function's CloudWatch Logs (JSON or Text)"
+    debug_sample_rate               = "Fraction of events (0.0 to 1.0) for which debug logging is enabled, regardless of log_level"
+    overlap_window_sec              = "Seconds after a renewed channel is first seen during which duplicate events are suppressed"
     log_retention_days              = "Number of days for which this Lambda function's CloudWatch Logs should be retained"
     aws_lambda_powertools_layer_arn = "ARN of python3.12 compatible Lambda Layer for aws-lambda-powertools
   }
@@ -79,3 +85,43 @@ lambda_settings = {
 }
 EOT
 }
+
+variable "watchdog" {
+  type = object({
+    enabled             = optional(bool, false)
+    schedule_expression = optional(string, "rate(15 minutes)")
+    window_minutes      = optional(number, 60)
+    lookback_days       = optional(number, 7)
+    threshold           = optional(number, 0.001)
+    lambda = optional(object({
+      timeout                         = optional(number, 60)
+      memory                          = optional(number, 128)
+      log_level                       = optional(string, "INFO")
+      log_retention_days              = optional(number, 30)
+      aws_lambda_powertools_layer_arn = optional(string, null)
+    }), {})
+  })
+  description = <<EOT
+watchdog = {
+  enabled             = "Boolean to indicate if channels that silently stop receiving events should be automatically recovered"
+  schedule_expression = "EventBridge schedule expression for how often the watchdog should check for silent channels"
+  window_minutes      = "Number of recent minutes without events that are checked for being anomalous"
+  lookback_days       = "Number of previous days of event history, at the same time of day, used as a baseline for each application"
+  threshold           = "Probability, given the baseline arrival rate, below which a silent window is considered anomalous"
+  lambda = {
+    timeout                         = "Timeout for Lambda function"
+    memory                          = "Memory, in MB, for Lambda function"
+    log_level                       = "String version of the Python logging levels (eg: INFO, DEBUG, CRITICAL) "
+    log_retention_days              = "Number of days for which this Lambda function's CloudWatch Logs should be retained"
+    aws_lambda_powertools_layer_arn = "ARN of python3.12 compatible Lambda Layer for aws-lambda-powertools
+  }
+}
+EOT
+  default     = {}
+
+  validation {
+    # 5 minute metric data, used for the baseline, is only retained for 15 days
+    condition     = var.watchdog.lookback_days >= 1 && var.watchdog.lookback_days <= 14
+    error_message = "watchdog.lookback_days must be between 1 and 14."
+  }
+}
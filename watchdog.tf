@@ -0,0 +1,128 @@
+locals {
+  watchdog_function_name = "${var.prefix}-gsuite-admin-reports-watchdog"
+}
+
+resource "aws_cloudwatch_log_group" "watchdog_lambda" {
+  count             = var.watchdog.enabled == true ? 1 : 0
+  name              = "/aws/lambda/${local.watchdog_function_name}"
+  retention_in_days = var.watchdog.lambda.log_retention_days
+}
+
+resource "aws_iam_role" "watchdog" {
+  count              = var.watchdog.enabled == true ? 1 : 0
+  name               = "${local.watchdog_function_name}-role"
+  assume_role_policy = data.aws_iam_policy_document.lambda_assume_role.json
+}
+
+resource "aws_lambda_function" "watchdog" {
+  count            = var.watchdog.enabled == true ? 1 : 0
+  function_name    = local.watchdog_function_name
+  handler          = "main.handler"
+  memory_size      = var.watchdog.lambda.memory
+  publish          = true
+  role             = aws_iam_role.watchdog[0].arn
+  runtime          = "python3.12"
+  timeout          = var.watchdog.lambda.timeout
+  filename         = data.archive_file.watchdog[0].output_path
+  source_code_hash = data.archive_file.watchdog[0].output_base64sha256
+
+  layers = [
+    coalesce(
+      var.watchdog.lambda.aws_lambda_powertools_layer_arn,
+      # Default to public Lambda layer corresponding to semantic version v2.41.0 of aws-lambda-powertools
+      # Reference: https://docs.powertools.aws.dev/lambda/python/2.41.0/#lambda-layer
+      "arn:aws:lambda:${local.region}:017000801446:layer:AWSLambdaPowertoolsPythonV2:76"
+    )
+  ]
+
+  environment {
+    variables = {
+      PREFIX                       = var.prefix
+      LOG_LEVEL                    = var.watchdog.lambda.log_level
+      POWERTOOLS_METRICS_NAMESPACE = local.metrics_namespace
+      APPLICATIONS                 = jsonencode(setsubtract(var.applications, var.stop_applications))
+      WINDOW_MINUTES               = var.watchdog.window_minutes
+      LOOKBACK_DAYS                = var.watchdog.lookback_days
+      THRESHOLD                    = var.watchdog.threshold
+      STATE_MACHINE_ARN            = local.state_machine_arn
+      CHANNEL_RENEWER_FUNCTION     = aws_lambda_alias.channeler.arn
+    }
+  }
+}
+
+resource "aws_lambda_alias" "watchdog" {
+  count            = var.watchdog.enabled == true ? 1 : 0
+  description      = "production alias for ${aws_lambda_function.watchdog[0].function_name}"
+  function_name    = aws_lambda_function.watchdog[0].function_name
+  function_version = aws_lambda_function.watchdog[0].version
+  name             = "production"
+}
+
+data "archive_file" "watchdog" {
+  count       = var.watchdog.enabled == true ? 1 : 0
+  type        = "zip"
+  source_dir  = "${path.module}/functions/watchdog"
+  output_path = "${path.module}/builds/watchdog.zip"
+}
+
+data "aws_iam_policy_document" "watchdog" {
+  count = var.watchdog.enabled == true ? 1 : 0
+  statement {
+    effect    = "Allow"
+    actions   = ["cloudwatch:GetMetricData"]
+    resources = ["*"]
+  }
+  statement {
+    effect    = "Allow"
+    actions   = ["states:ListExecutions"]
+    resources = [aws_sfn_state_machine.channeler.arn]
+  }
+  statement {
+    effect    = "Allow"
+    actions   = ["lambda:InvokeFunction"]
+    resources = [aws_lambda_alias.channeler.arn]
+  }
+  statement {
+    effect = "Allow"
+    actions = [
+      "logs:CreateLogGroup",
+      "logs:CreateLogStream",
+      "logs:PutLogEvents",
+    ]
+    resources = [
+      "${aws_cloudwatch_log_group.watchdog_lambda[0].arn}:*",
+      "${aws_cloudwatch_log_group.watchdog_lambda[0].arn}:*:*",
+    ]
+  }
+}
+
+resource "aws_iam_role_policy" "watchdog" {
+  count  = var.watchdog.enabled == true ? 1 : 0
+  name   = "DefaultPolicy"
+  role   = aws_iam_role.watchdog[0].name
+  policy = data.aws_iam_policy_document.watchdog[0].json
+}
+
+resource "aws_cloudwatch_event_rule" "watchdog" {
+  count               = var.watchdog.enabled == true ? 1 : 0
+  name                = "${local.watchdog_function_name}-schedule"
+  description         = "Periodically check for gsuite-channeler applications that have stopped receiving events"
+  schedule_expression = var.watchdog.schedule_expression
+}
+
+resource "aws_cloudwatch_event_target" "watchdog" {
+  count     = var.watchdog.enabled == true ? 1 : 0
+  target_id = "${local.watchdog_function_name}-schedule"
+  rule      = aws_cloudwatch_event_rule.watchdog[0].name
+  arn       = aws_lambda_alias.watchdog[0].arn
+}
+
+resource "aws_lambda_permission" "watchdog" {
+  count         = var.watchdog.enabled == true ? 1 : 0
+  statement_id  = "CloudWatchExecution"
+  principal     = "events.amazonaws.com"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.watchdog[0].function_name
+  qualifier     = aws_lambda_alias.watchdog[0].name
+  source_arn    = aws_cloudwatch_event_rule.watchdog[0].arn
+}